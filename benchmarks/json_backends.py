@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Times json_encode and json_decode on every json backend installed, over
+the shapes nudge handles: error bodies, a page of records as endpoints
+return them, objects going through the json() protocol, and a large
+request body.
+
+    python -m benchmarks.json_backends
+"""
+import datetime
+import timeit
+
+import nudge.json
+from nudge.json import JsonSerializable
+
+NUMBER = 2000
+
+class User(JsonSerializable):
+    def __init__(self, i):
+        self.id = i
+        self.name = u'user %d' % i
+        self.email = 'user%d@example.com' % i
+        self.created = datetime.datetime(2011, 1, 1, 12, i % 60)
+        self.tags = ['a', 'b', 'c']
+
+def record(i):
+    return {
+        'id': i,
+        'name': u'caf\xe9 %d' % i,
+        'score': i * 1.5,
+        'active': i % 2 == 0,
+        'parent': None,
+        'tags': ['x', 'y'],
+        'address': {'city': 'Los Angeles', 'zip': '90012'},
+    }
+
+PAYLOADS = [
+    ('error', {'message': 'invalid value for argument', 'code': 400}, 1),
+    ('records', {'total': 50, 'items': [record(i) for i in range(50)]}, 1),
+    ('objects', {'users': [User(i) for i in range(50)]}, 1),
+    ('body', [record(i) for i in range(2000)], 50),
+]
+
+def run():
+    backends = nudge.json.available_backends()
+    print "backends: %s" % ', '.join(backends)
+    print "%-10s %-12s %8s %12s %12s" % (
+        "payload", "backend", "bytes", "encode us", "decode us")
+    try:
+        for label, payload, divisor in PAYLOADS:
+            number = NUMBER / divisor
+            for name in backends:
+                nudge.json.use_backend(name)
+                encoded = nudge.json.json_encode(payload)
+                t_enc = timeit.timeit(
+                    lambda: nudge.json.json_encode(payload), number=number)
+                t_dec = timeit.timeit(
+                    lambda: nudge.json.json_decode(encoded), number=number)
+                print "%-10s %-12s %8d %12.2f %12.2f" % (
+                    label, name, len(encoded),
+                    t_enc / number * 1e6, t_dec / number * 1e6)
+    finally:
+        nudge.json.use_backend('simplejson')
+
+if __name__ == '__main__':
+    run()
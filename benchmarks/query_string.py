@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Compares nudge.publisher.parse_query_string with the old unescape first,
+then split parser, on short, long and repeated key query strings.
+
+    python -m benchmarks.query_string
+"""
+import timeit
+import urllib
+
+from nudge.publisher import parse_query_string
+
+NUMBER = 5000
+
+QUERIES = [
+    ('short', 'q=shoes&page=2'),
+    ('long', '&'.join(
+        'filter%d=%s' % (i, urllib.quote_plus('value %d/x' % i))
+        for i in range(40))),
+    ('repeated', '&'.join('tag=t%d' % i for i in range(100))),
+]
+
+def old(qs):
+    arguments = {}
+    tmp = unicode(urllib.unquote_plus(qs), encoding="utf-8")
+    tmp = tmp.split('&')
+    tmp = [a.split('=') for a in tmp]
+    tmp = filter(lambda x: len(x) == 2, tmp)
+    for a in tmp:
+        if a[0] in arguments:
+            arguments[a[0]].append(a[1])
+        else:
+            arguments[a[0]] = [a[1]]
+    return arguments
+
+def run():
+    print "%-10s %8s %12s %12s" % ("query", "bytes", "old us", "new us")
+    for label, qs in QUERIES:
+        t_old = timeit.timeit(lambda: old(qs), number=NUMBER)
+        t_new = timeit.timeit(
+            lambda: parse_query_string(qs, 1000, 256), number=NUMBER)
+        print "%-10s %8d %12.2f %12.2f" % (
+            label, len(qs),
+            t_old / NUMBER * 1e6,
+            t_new / NUMBER * 1e6,
+        )
+
+if __name__ == '__main__':
+    run()
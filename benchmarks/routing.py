@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Compares the router in nudge.router with the old linear scan over
+Endpoint.match, for service descriptions of different sizes.
+
+    python -m benchmarks.routing
+"""
+import timeit
+
+from nudge.publisher import Endpoint
+from nudge.router import Router
+
+SIZES = [10, 100, 1000]
+NUMBER = 2000
+
+def handler(): pass
+
+def build(size):
+    endpoints = [
+        Endpoint(
+            name='ep%d' % i,
+            method='GET',
+            uri='/api/v2/resource%d/(?P<id>[^/]+)$' % i,
+            function=handler,
+        )
+        for i in range(size)
+    ]
+    router = Router()
+    for endpoint in endpoints:
+        router.add(endpoint)
+    return endpoints, router
+
+def linear(endpoints, method, path):
+    reqline = method + path
+    for endpoint in endpoints:
+        match = endpoint.match(reqline)
+        if match:
+            return endpoint, match
+    return None, None
+
+def run():
+    print "%6s %-8s %12s %12s" % ("eps", "request", "linear us", "router us")
+    for size in SIZES:
+        endpoints, router = build(size)
+        router.match('GET', '/') # build the combined patterns up front
+        paths = [
+            ('first', '/api/v2/resource0/1234'),
+            ('last', '/api/v2/resource%d/1234' % (size - 1)),
+            ('404', '/api/v2/missing/1234'),
+        ]
+        for label, path in paths:
+            t_linear = timeit.timeit(
+                lambda: linear(endpoints, 'GET', path), number=NUMBER)
+            t_router = timeit.timeit(
+                lambda: router.match('GET', path), number=NUMBER)
+            print "%6d %-8s %12.2f %12.2f" % (
+                size, label,
+                t_linear / NUMBER * 1e6,
+                t_router / NUMBER * 1e6,
+            )
+
+if __name__ == '__main__':
+    run()
@@ -19,7 +19,9 @@
 import types
 import nudge
 import nudge.validator as validate
-from nudge.utils import dehump
+from nudge.error import HTTPException
+from nudge.headers import WSGIHeaders, normalize_name
+from nudge.utils import dehump, FunctionBuilder
 
 __all__ = [
     'Arg',
@@ -34,62 +36,90 @@ __all__ = [
     'Action',
     'JsonBody',
     'JsonBodyField',
+    'NdjsonBody',
+    'JsonBodyItems',
+    'RecordBody',
     'List',
     'Dict',
+    'compile_binder',
 ]
 
 class Arg(object):
+    # Subclasses that set more attributes, like custom args setting their
+    # own argspec, leave out __slots__ to get a __dict__.
+    __slots__ = ('name', 'optional', 'default', 'validator')
     
     def __init__(self, name, optional=False, default=None, validator=None):
-        # Are these class members unnecessary when using the below func?
         self.name = name
         self.optional = optional
         self.validator = validator
         self.default = default
-        def func(req, inargs):
-            exists = False
-            data = None
-            msg = None
-            # We should move this check into the Endpoint constructor
-            if not self.validator:
-                raise AttributeError(
-                    "Arg has no validator for property: '%s'" % self.name
-                )
-            if req.arguments and self.name in req.arguments:
-                exists = True
-                data = req.arguments[self.name]
-            elif inargs and self.name in inargs:
-                exists = True
+
+    def argspec(self, req, inargs):
+        exists = False
+        typed = False
+        data = None
+        # Endpoints check this when they are created, see compile_binder
+        if not self.validator:
+            raise AttributeError(
+                "Arg has no validator for property: '%s'" % self.name
+            )
+        if req.arguments and self.name in req.arguments:
+            exists = True
+            data = req.arguments[self.name]
+        elif inargs and self.name in inargs:
+            exists = True
+            lookup_typed = getattr(inargs, 'lookup_typed', None)
+            if lookup_typed is not None:
+                data, typed = lookup_typed(self.name)
+            else:
                 data = inargs[self.name]
-            # Default assumes optional=True
-            if not data:
-                if self.optional:
-                    return self.default
-                elif exists:
-                    msg = " is required, exists, but is empty"
-                else:
-                    msg = " is required but does not exist"
-                raise nudge.publisher.HTTPException(
-                    400, 
-                    self.name + msg
-                )
-            # Query string args will come in list format, take the first.
-            # Unless of course we are expecting a list from the json body.
-            if type(data) in [types.ListType] and not isinstance(self, List):
-                data = data[0]
-            try:
-                return self.validator(data)
-            except (validate.ValidationError), e:
-                msg = "invalid value for argument '%s': '%s'" % (
-                    self.name, 
-                    data
-                )
-                if e.message:
-                    msg += ': %s' % e.message
-                    raise nudge.publisher.HTTPException(400, msg)
-        self.argspec = func
-    
+        # Default assumes optional=True. A value a uri template converter
+        # made, like 0 from {id:int}, is never empty.
+        if not data and not typed:
+            if self.optional:
+                return self.default
+            raise _missing(self.name, exists)
+        # Query string args will come in list format, take the first.
+        # Unless of course we are expecting a list from the json body.
+        if type(data) in [types.ListType] and not isinstance(self, List):
+            data = data[0]
+        try:
+            return self.validator(data)
+        except (validate.ValidationError), e:
+            raise _invalid(self.name, data, e)
+
+def _missing(name, exists):
+    if exists:
+        msg = " is required, exists, but is empty"
+    else:
+        msg = " is required but does not exist"
+    return HTTPException(400, name + msg)
+
+def _invalid(name, data, e):
+    msg = "invalid value for argument '%s': '%s'" % (name, data)
+    if e.message:
+        msg += ': %s' % e.message
+    return HTTPException(400, msg)
+
+_XFF = normalize_name("X-Forwarded-For")
+_CONTENT_TYPE = normalize_name("Content-Type")
+
+def _header(req, name, header):
+    """ A request header by its normalized name, or by header for headers
+        that are a plain dict """
+    headers = req.headers
+    if isinstance(headers, WSGIHeaders):
+        return headers.lookup(name, None, header)
+    return headers.get(header)
+
 class CustomArg(Arg):
+    # whether argspec looks args up in inargs, which may then come from
+    # the body
+    reads_inargs = True
+    # whether argspec hands the body to the endpoint as it is read, which
+    # can only be done once per request
+    streams_body = False
 
     def __init__(self, name=None):
         if not name and hasattr(self, '__name__'):
@@ -103,6 +133,8 @@ class CustomArg(Arg):
 class String(Arg): 
     """ Standard unicode string. No size restrictions """
 
+    __slots__ = ()
+
     def __init__(self, name, optional=False, max_len=None):
         validator = validate.NotEmpty()
         if optional:
@@ -115,6 +147,8 @@ class String(Arg):
 
 class Dict(Arg): 
 
+    __slots__ = ()
+
     def __init__(self, name, min_=None, max_=None, 
                  optional=False):
         super(Dict, self).__init__(
@@ -126,6 +160,8 @@ class Dict(Arg):
 
 class List(Arg): 
 
+    __slots__ = ()
+
     def __init__(self, name, min_=None, max_=None, 
                  optional=False):
         super(List, self).__init__(
@@ -137,6 +173,8 @@ class List(Arg):
 
 class Boolean(Arg):
 
+    __slots__ = ()
+
     def __init__(self, name, default=None, optional=False):
         super(Boolean, self).__init__(
             name, 
@@ -147,6 +185,8 @@ class Boolean(Arg):
 
 class Date(Arg):
 
+    __slots__ = ()
+
     def __init__(self, name, default=None, optional=False):
         super(Date, self).__init__(
             name, 
@@ -157,6 +197,8 @@ class Date(Arg):
 
 class Json(Arg):
 
+    __slots__ = ()
+
     def __init__(self, name, default=None, optional=False):
         super(Json, self).__init__(
             name, 
@@ -167,6 +209,8 @@ class Json(Arg):
 
 class Integer(Arg): 
 
+    __slots__ = ()
+
     def __init__(self, name, min_=None, max_=None, 
                  default=None, optional=False):
         super(Integer, self).__init__(
@@ -177,10 +221,12 @@ class Integer(Arg):
         )
 
 class ClientIp(CustomArg):
-    
+
+    reads_inargs = False
+
     def __init__(self):
         def func(req, inargs):
-            client_ip = req.headers.get("X-Forwarded-For", "") or req.remote_ip
+            client_ip = _header(req, _XFF, "X-Forwarded-For") or req.remote_ip
             if client_ip:
                 # client, proxy1, proxy2, ...
                 client_ip = client_ip.partition(",")[0].strip()
@@ -189,29 +235,57 @@ class ClientIp(CustomArg):
 
 class RequestHeader(CustomArg):
 
+    reads_inargs = False
+
     def __init__(self, header):
+        name = normalize_name(header)
         def func(req, inargs):
-            return req.headers.get(header)
+            return _header(req, name, header)
         self.argspec = func
 
 class Action(Arg):
+    __slots__ = ()
     actions = [
         "add",
         "edit",
         "delete",
     ]
-    validators = [validate.StringAlternatives(actions)]
+
+    def __init__(self, name, default=None, optional=False):
+        super(Action, self).__init__(
+            name,
+            optional,
+            default,
+            validate.StringAlternatives(self.actions)
+        )
 
 class UploadedFile(CustomArg):
+    """ The first file uploaded under name in a multipart body, as a dict
+        with its filename, content_type, data (its content as a byte
+        string) and file (a file object, which stays on disk for large
+        uploads). With as_file, data is left out so large uploads are
+        never read into memory. """
 
-    def __init__(self, name):
+    reads_inargs = False
+
+    def __init__(self, name, optional=False, as_file=False):
         def func(req, inargs):
-            f = req.files[name][0]
-            return {
+            files = req.files.get(name)
+            if not files:
+                if optional:
+                    return None
+                raise _missing(name, False)
+            f = files[0]
+            upload = {
                 'filename': f['filename'],
-                'data': f['body'],
+                'file': f['body'],
                 'content_type': f['content_type'],
             }
+            if not as_file:
+                f['body'].seek(0)
+                upload['data'] = f['body'].read()
+                f['body'].seek(0)
+            return upload
         self.argspec = func
 
 class JsonBody(CustomArg):
@@ -227,9 +301,12 @@ class JsonBody(CustomArg):
         as a single arg (maybe the body is very large)
     """
 
+    reads_inargs = False
+
     def __init__(self, optional=False, extend={}):
         def func(req, inargs):
-            if not req.body: 
+            json_body = _get_json_body(req)
+            if json_body is None:
                 if optional:
                     return None
                 else:
@@ -237,7 +314,6 @@ class JsonBody(CustomArg):
                         400, 
                         "json body is not optional"
                     )
-            json_body = _get_json_body(req)
             if extend:
                 return dict(json_body, **extend)
             return json_body
@@ -250,6 +326,9 @@ class JsonBodyField(CustomArg):
         application/json, the json body will be decoded and added to the arg
         dict (so you dont need to use this, you can use normal args).
     """
+
+    reads_inargs = False
+
     def __init__(self, fieldname, optional=False, validator=None):
         self.name = fieldname
         def func(req, inargs):
@@ -267,19 +346,183 @@ class JsonBodyField(CustomArg):
             return None
         self.argspec = func
 
-def _get_json_body(req):
-    """ decode and cache json body """
+NDJSON_CONTENT_TYPES = (
+    'application/x-ndjson',
+    'application/ndjson',
+    'application/jsonlines',
+)
 
-    if '_body_dict' in req.arguments:
-        return req.arguments['_body_dict']
+class NdjsonBody(CustomArg):
+    """ A newline delimited JSON body, passed to the endpoint as a generator
+        of the decoded records. Records are read from the client, decoded
+        and checked with validator as the endpoint asks for them, so a bulk
+        import runs in constant memory and can start before the upload has
+        finished. The endpoint must consume it before returning.
 
-    if not req.body:
-        return None
+        A record that is not JSON or fails validation raises a 400 from the
+        generator. A body of another content type is a 415, or None if the
+        arg is optional. """
 
-    try:
-        body = nudge.json.json_decode(req.body)
-        req.arguments['_body_dict'] = body # cache it
-        return body
-    except (ValueError):
-        raise nudge.publisher.HTTPException(400, "body is not JSON")
+    reads_inargs = False
+    streams_body = True
+
+    def __init__(self, validator=None, optional=False):
+        def func(req, inargs):
+            content_type = _header(req, _CONTENT_TYPE, "Content-Type") or ""
+            content_type = content_type.partition(";")[0].strip().lower()
+            if content_type not in NDJSON_CONTENT_TYPES:
+                if optional:
+                    return None
+                raise HTTPException(415, "body must be newline delimited json")
+            return _validate_records(req.iter_ndjson(), validator)
+        self.argspec = func
+
+class JsonBodyItems(CustomArg):
+    """ The values at path in a JSON body, passed to the endpoint as a
+        generator, so JsonBodyItems('items.*') gives each element of the
+        body's top level "items" array in turn. The body is decoded as the
+        endpoint asks for values and only the one being handed over is
+        built, so very large documents run in constant memory. The endpoint
+        must consume it before returning.
+
+        A body that is not JSON, or a value failing validator, raises a 400
+        from the generator. A body of another content type is a 415, or
+        None if the arg is optional. """
+
+    reads_inargs = False
+    streams_body = True
+
+    def __init__(self, path, validator=None, optional=False):
+        def func(req, inargs):
+            content_type = _header(req, _CONTENT_TYPE, "Content-Type") or ""
+            content_type = content_type.partition(";")[0].strip().lower()
+            if content_type != 'application/json':
+                if optional:
+                    return None
+                raise HTTPException(415, "body must be json")
+            return _validate_records(req.iter_json(path), validator)
+        self.argspec = func
+
+class RecordBody(CustomArg):
+    """ The JSON body validated into a record, a class made with
+        nudge.record.record(), or with many into a list of them from a
+        body that is a JSON array. A body that does not validate is a 400
+        naming the field, and the record for many. """
+
+    reads_inargs = False
+
+    def __init__(self, record, optional=False, many=False):
+        def func(req, inargs):
+            body = _get_json_body(req)
+            if body is None:
+                if optional:
+                    return None
+                raise HTTPException(400, "json body is not optional")
+            if not many:
+                try:
+                    return record.from_json(body)
+                except (validate.ValidationError), e:
+                    raise HTTPException(400, "invalid body: %s" % e.message)
+            if not isinstance(body, list):
+                raise HTTPException(400, "invalid body: must be of type list")
+            records = []
+            from_json = record.from_json
+            for number, item in enumerate(body):
+                try:
+                    records.append(from_json(item))
+                except (validate.ValidationError), e:
+                    raise HTTPException(400, "invalid body: record %d: %s" % (
+                        number + 1, e.message))
+            return records
+        self.argspec = func
 
+def _validate_records(records, validator):
+    for number, record in enumerate(records):
+        if validator:
+            try:
+                record = validator(record)
+            except (validate.ValidationError), e:
+                raise _invalid("record %d" % (number + 1), record, e)
+        yield record
+
+def _get_json_body(req):
+    """ The decoded json body, which the request decodes only once """
+    return req.json_body
+
+
+def _is_standard(arg):
+    """ Whether arg resolves through Arg.argspec, so its lookup and
+        validation can be inlined by compile_binder """
+    return isinstance(arg, Arg) and not isinstance(arg, CustomArg) and \
+        getattr(arg.argspec, 'im_func', None) is Arg.__dict__['argspec']
+
+_STANDARD_ARG = """\
+data, typed = lookup(%(name)s, _absent)
+exists = data is not _absent
+if not exists:
+    data = None
+if not data and not typed:
+    %(missing)s
+else:
+    %(unlist)s
+    try:
+        value = %(validator)s(data)
+    except ValidationError, e:
+        raise _invalid(%(name)s, data, e)
+"""
+
+def _bind_nothing(req, inargs):
+    return (), {}
+
+def compile_binder(sequential, named):
+    """ Compiles the args of an endpoint into one function of (req, inargs)
+        returning the (args, kwargs) to call the endpoint function with.
+        inargs is the request's nudge.publisher.ArgumentView.
+
+        The lookup and validation of standard args is generated inline, so
+        binding a request is a single straight pass with no per-arg calls
+        beyond the validators. Path args a uri template converter produced
+        are never empty, so a converted 0 is still validated. Custom
+        args still go through their argspec. Args without a validator are
+        refused here rather than on every request. """
+    sequential = sequential or []
+    named = named or {}
+    if not sequential and not named:
+        return _bind_nothing
+
+    f = FunctionBuilder('bind', ['req', 'inargs'], {
+        '_absent': object(),
+        'ValidationError': validate.ValidationError,
+        '_missing': _missing,
+        '_invalid': _invalid,
+    })
+    if [a for a in sequential + named.values() if _is_standard(a)]:
+        f.add('lookup = inargs.lookup_typed')
+    f.add('args = []')
+    f.add('kwargs = {}')
+
+    entries = [(None, arg) for arg in sequential] + named.items()
+    for key, arg in entries:
+        if _is_standard(arg):
+            assert arg.validator, \
+                "Arg has no validator for property: '%s'" % arg.name
+            names = {'name': f.const(arg.name),
+                     'validator': f.const(arg.validator)}
+            if arg.optional:
+                names['missing'] = 'value = %s' % f.const(arg.default)
+            else:
+                names['missing'] = 'raise _missing(%(name)s, exists)' % names
+            if isinstance(arg, List):
+                names['unlist'] = 'pass'
+            else:
+                names['unlist'] = 'if type(data) is list: data = data[0]'
+            f.add(_STANDARD_ARG % names)
+        else:
+            f.add('value = %s(req, inargs)' % f.const(arg.argspec))
+        if key is None:
+            f.add('args.append(value)')
+        else:
+            f.add('if value is not None:')
+            f.add('kwargs[%s] = value' % f.const(key), 2)
+    f.add('return args, kwargs')
+    return f.compile()
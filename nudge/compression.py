@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Streaming decompression of gzip and deflate request bodies.
+
+An Inflater sits between the chunks read from wsgi.input and whatever
+consumes the body. It never inflates more than chunk_size bytes at a time,
+so a small upload that expands enormously (a zip bomb) is stopped by the
+size and ratio limits before it can take up memory.
+"""
+
+import zlib
+
+from nudge.error import HTTPException
+
+__all__ = [
+    'Inflater',
+    'ENCODINGS',
+]
+
+ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+# Ratios are only checked past this many inflated bytes, so small bodies
+# of very repetitive JSON are not refused.
+RATIO_GRACE = 64 * 1024
+
+
+class Inflater(object):
+
+    def __init__(self, encoding, write, max_size=None, max_ratio=None,
+                 chunk_size=64 * 1024):
+        """ Inflates the encoding, one of ENCODINGS, passing the output to
+            write. More than max_size inflated bytes, or more than max_ratio
+            inflated bytes per compressed byte, fail with a 413. """
+        if encoding not in ENCODINGS:
+            raise HTTPException(415, "unsupported Content-Encoding")
+        self.encoding = encoding
+        self.write = write
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.chunk_size = chunk_size
+        self.size_in = 0
+        self.size_out = 0
+        # the start of a deflate body, until it is long enough to tell
+        self._head = ''
+        if encoding == 'deflate':
+            # zlib wrapped, as the spec says, unless its first two bytes
+            # show it to be raw deflate, which some clients send
+            self._inflater = None
+        else:
+            self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data):
+        self.size_in += len(data)
+        try:
+            if self._inflater is None:
+                # the zlib header is two bytes, which a chunk may split
+                data = self._head + data
+                if len(data) < 2:
+                    self._head = data
+                    return
+                self._head = ''
+                self._inflater = zlib.decompressobj(zlib.MAX_WBITS)
+                try:
+                    self._inflate(data)
+                    return
+                except zlib.error:
+                    if self.size_out:
+                        raise
+                    self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._inflate(data)
+        except zlib.error:
+            raise HTTPException(400, "invalid %s body" % self.encoding)
+
+    def _inflate(self, data):
+        inflater = self._inflater
+        while True:
+            out = inflater.decompress(data, self.chunk_size)
+            self._output(out)
+            data = inflater.unconsumed_tail
+            # a full chunk out may leave more output pending
+            if not data and len(out) < self.chunk_size:
+                break
+
+    def _output(self, out):
+        if not out:
+            return
+        self.size_out += len(out)
+        if self.max_size is not None and self.size_out > self.max_size:
+            raise HTTPException(413)
+        if self.max_ratio is not None and self.size_out > RATIO_GRACE and \
+           self.size_out > self.max_ratio * self.size_in:
+            raise HTTPException(413, "body compression ratio too high")
+        self.write(out)
+
+    def close(self):
+        """ Checks the compressed stream ended where the body did """
+        if self._inflater is None:
+            if self._head:
+                raise HTTPException(400, "truncated %s body" % self.encoding)
+            # an empty body
+            return
+        if self.size_in and not self._eof():
+            raise HTTPException(400, "truncated %s body" % self.encoding)
+
+    def _eof(self):
+        # decompressobj only has an eof attribute from python 3.3 on. Before
+        # that, the end of the stream shows in data fed after it being left
+        # in unused_data.
+        eof = getattr(self._inflater, 'eof', None)
+        if eof is not None:
+            return eof
+        try:
+            return self._inflater.decompress('x') == '' and \
+                self._inflater.unused_data.endswith('x')
+        except zlib.error:
+            return False
@@ -150,9 +150,11 @@ def handle_exception(exp, exp_handlers, default_handler):
 
 class HTTPException(Exception):
 
-    def __init__(self, status_code, message=None):
+    def __init__(self, status_code, message=None, headers=None):
         self.status_code = status_code
         self.message = message
+        # sent with the response whichever error handler renders it
+        self.headers = headers or {}
 
 class SecurityException(Exception):
     pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+__all__ = [
+    'WSGIHeaders',
+    'normalize_name',
+]
+
+# Headers that CGI, and so WSGI, keeps without the HTTP_ prefix
+_CGI_HEADERS = {
+    'CONTENT_TYPE': 'content_type',
+    'CONTENT_LENGTH': 'content_length',
+}
+_ENVIRON_KEYS = dict((v, k) for k, v in _CGI_HEADERS.iteritems())
+
+_absent = object()
+
+def normalize_name(n):
+    """ The name headers are stored under: lower case, with '_' for '-' """
+    return n.lower().replace('-','_')
+
+
+class WSGIHeaders(dict):
+    """ Request headers by normalized name, so 'X-Forwarded-For',
+        'x-forwarded-for' and 'X_FORWARDED_FOR' are the same header.
+
+        Built with from_environ(), each header is looked up in the WSGI
+        environ the first time it is asked for instead of all of them being
+        copied in up front, and a header that is not there is remembered
+        as missing. lookup() takes a name that is already normalized, so
+        callers that normalize their names once skip doing it on every
+        request. """
+
+    _environ = None
+    _missing = None
+
+    def __init__(self, *args, **kwargs):
+        super(WSGIHeaders, self).__init__()
+        for k, v in dict(*args, **kwargs).iteritems():
+            self[k] = v
+
+    @classmethod
+    def from_environ(cls, environ):
+        headers = cls()
+        headers._environ = environ
+        headers._missing = set()
+        return headers
+
+    normalize_name = staticmethod(normalize_name)
+
+    def lookup(self, name, default=None, header=None):
+        """ get() for a normalized name. Some servers keep the '-' in
+            environ keys (HTTP_X-Forwarded-For); those are only found when
+            header, the name as sent, is given too. """
+        try:
+            return dict.__getitem__(self, name)
+        except KeyError:
+            pass
+        environ = self._environ
+        if environ is None:
+            return default
+        keys = []
+        if name not in self._missing:
+            keys.append(_ENVIRON_KEYS.get(name) or 'HTTP_' + name.upper())
+        if header and '-' in header:
+            keys.append('HTTP_' + header)
+            keys.append('HTTP_' + header.upper())
+        for key in keys:
+            if key in environ:
+                value = environ[key]
+                dict.__setitem__(self, name, value)
+                return value
+        self._missing.add(name)
+        return default
+
+    def _load(self):
+        """ Copies in every header not looked up yet """
+        environ = self._environ
+        if environ is None:
+            return
+        self._environ = None
+        for k, v in environ.iteritems():
+            if k.startswith('HTTP_'):
+                name = normalize_name(k[5:])
+            elif k in _CGI_HEADERS:
+                name = _CGI_HEADERS[k]
+            else:
+                continue
+            # headers set on the request since win
+            dict.setdefault(self, name, v)
+
+    def __getitem__(self, key):
+        value = self.lookup(normalize_name(key), _absent, key)
+        if value is _absent:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        return dict.__setitem__(self, normalize_name(key), value)
+
+    def __delitem__(self, key):
+        self._load()
+        return dict.__delitem__(self, normalize_name(key))
+
+    def __contains__(self, key):
+        return self.lookup(normalize_name(key), _absent, key) is not _absent
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        return self.lookup(normalize_name(key), default, key)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._load()
+        return dict.__repr__(self)
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self._load()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self._load()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._load()
+        return dict.iteritems(self)
+
+    def copy(self):
+        self._load()
+        return WSGIHeaders(self)
@@ -16,10 +16,19 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 
+# so 'import json' below is the standard library, not this module
+from __future__ import absolute_import
+
 import datetime
+import decimal
+import inspect
+import logging
 import re
 import time
 import types
+import uuid
+
+from nudge.utils import FunctionBuilder
 
 try:
     from simplejson import JSONEncoder, JSONDecoder
@@ -33,6 +42,8 @@ except:
             "simplejson and try again."
         )
 
+_log = logging.getLogger("nudge.json")
+
 __all__ = [
     'Encoder',
     'json_encode',
@@ -42,39 +53,285 @@ __all__ = [
     'dehump',
     'hump',
     'Dictomatic',
+    'BACKENDS',
+    'use_backend',
+    'get_backend',
+    'available_backends',
+    'register_serializer',
 ]
 
+# type -> function turning its instances into something json can encode
+_serializers = {}
+# The serializer found for each exact type seen, or None, so the lookup
+# through the class hierarchy is done once per type rather than per object.
+_resolved = {}
+
+def register_serializer(cls, serialize):
+    """ Makes json_encode encode instances of cls, and of its subclasses,
+        as what serialize(instance) returns, which must be something json
+        can encode. A serializer registered for the exact type of an object
+        wins over its json() method, one for a base class does not. """
+    assert isinstance(cls, (type, types.ClassType)), "cls must be a class"
+    assert callable(serialize), "serialize must be callable"
+    _serializers[cls] = serialize
+    _resolved.clear()
+
+def _call_json(o):
+    return o.json()
+
+def _resolve(cls):
+    if cls in _serializers:
+        return _serializers[cls]
+    if issubclass(cls, JsonSerializable) and \
+       cls.json.im_func is JsonSerializable.__dict__['json']:
+        # straight to the compiled serializer, skipping json()
+        return _class_serializer(cls)
+    if hasattr(cls, "json"):
+        return _call_json
+    for base in inspect.getmro(cls)[1:]:
+        if base in _serializers:
+            return _serializers[base]
+    return None
+
+def _default(o):
+    """ Encodes what json cannot, with the serializer registered for the
+        type of o or its json() method """
+    cls = type(o)
+    if cls is types.InstanceType:
+        # every old style instance has the same type
+        cls = o.__class__
+    try:
+        serialize = _resolved[cls]
+    except KeyError:
+        serialize = _resolved[cls] = _resolve(cls)
+    if serialize is None:
+        if hasattr(o, "json"):
+            return o.json()
+        raise TypeError(repr(o) + " is not JSON serializable")
+    return serialize(o)
+
 class Encoder(JSONEncoder):
 
     def default(self, o):
-        if hasattr(o, "json"):
-            return getattr(o, "json")()
-        if isinstance(o, datetime.datetime):
-            return o.ctime()
-        return JSONEncoder.default(self, o)
+        return _default(o)
 
 _encoder = Encoder()
+# Not strict, so tabs and other control characters inside strings are
+# accepted as they are instead of being stripped out with a copy of the
+# whole document first.
+_decoder = JSONDecoder(strict=False)
+
+# The backends json_encode and json_decode can run on, fastest first, which
+# is the order 'auto' tries them in. simplejson is the default, it is what
+# the output of nudge has always been byte for byte. The others all give
+# the same JSON, but ujson, rapidjson and orjson leave out the spaces after
+# ',' and ':'.
+BACKENDS = ('orjson', 'ujson', 'rapidjson', 'simplejson', 'json')
+
+def _simplejson():
+    return _encoder.encode, _decoder.decode
+
+def _stdlib():
+    import json
+    encoder = json.JSONEncoder(default=_default)
+    decoder = json.JSONDecoder(strict=False)
+    return encoder.encode, decoder.decode
+
+def _ujson():
+    import ujson
+    def encode(o):
+        return ujson.dumps(o, default=_default, escape_forward_slashes=False)
+    return encode, ujson.loads
+
+def _rapidjson():
+    import rapidjson
+    def encode(o):
+        return rapidjson.dumps(o, default=_default)
+    return encode, rapidjson.loads
+
+def _orjson():
+    import orjson
+    # orjson writes datetimes itself unless told to pass them to default
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    def encode(o):
+        return orjson.dumps(o, default=_default, option=option)
+    return encode, orjson.loads
+
+_LOADERS = {
+    'simplejson': _simplejson,
+    'json': _stdlib,
+    'ujson': _ujson,
+    'rapidjson': _rapidjson,
+    'orjson': _orjson,
+}
+
+class _Probe(object):
+    def json(self):
+        return {"a": [1, 2.5, None, True]}
+
+def _load(name):
+    """ The (encode, decode) functions of backend name, or None if it is
+        not installed or does not keep the semantics of the simplejson one:
+        the json() protocol, datetimes as ctime(), and tabs in strings. A
+        decoder that fails is swapped for the simplejson one. """
+    try:
+        encode, decode = _LOADERS[name]()
+    except ImportError:
+        return None
+    when = datetime.datetime(2011, 1, 2, 3, 4, 5)
+    try:
+        data = _decoder.decode(encode(
+            {"when": when, "obj": _Probe(), "text": u"caf\xe9/"}))
+        if data != {"when": when.ctime(), "obj": _Probe().json(),
+                    "text": u"caf\xe9/"}:
+            return None
+    except (TypeError, ValueError):
+        return None
+    try:
+        if decode('{"a": "x\ty", "b": [1, 2.5]}') != \
+           {"a": "x\ty", "b": [1, 2.5]}:
+            decode = _decoder.decode
+    except (TypeError, ValueError):
+        decode = _decoder.decode
+    return encode, decode
+
+def available_backends():
+    """ The names of the backends that can be used here, fastest first """
+    return [name for name in BACKENDS if _load(name) is not None]
+
+_backend = 'simplejson'
+_encode, _decode = _simplejson()
+
+def use_backend(name):
+    """ Makes json_encode and json_decode, and so every renderer and
+        request of the process, run on the backend name, one of BACKENDS,
+        or on the fastest one installed for 'auto'. Returns the name of the
+        backend chosen. """
+    global _backend, _encode, _decode
+    assert name == 'auto' or name in BACKENDS, \
+        "json backend must be 'auto' or one of %s" % ', '.join(BACKENDS)
+    names = BACKENDS if name == 'auto' else [name]
+    for n in names:
+        functions = _load(n)
+        if functions is not None:
+            _backend = n
+            _encode, _decode = functions
+            _log.info("json backend: %s", n)
+            return n
+    raise ImportError("json backend %s is not available" % name)
+
+def get_backend():
+    """ The name of the backend in use """
+    return _backend
+
 def json_encode(o):
-    return _encoder.encode(o)
+    return _encode(o)
 
-_decoder = JSONDecoder()
 def json_decode(o):
-    # remove tabs if they exists
-    o = o.replace('\t','')
-    data = _decoder.decode(o)
-    return data
+    return _decode(o)
 
 class JsonSerializable(object):
+    """ Encodes as a dict of its attributes that are not None, slots
+        included, with the attributes that are JsonSerializable themselves
+        encoded the same way. The function doing it is compiled for each
+        class the first time one of its instances is encoded. """
+
+    __slots__ = ()
 
     def json(self):
-        # TODO: ugly
-        d = {}
-        for k, v in self.__dict__.iteritems():
-            if isinstance(v, JsonSerializable):
-                d[k] = v.json()
-            elif v is not None:
-                d[k] = v
-        return d
+        return _class_serializer(type(self))(self)
+
+# class -> its compiled serializer
+_class_serializers = {}
+
+def _class_serializer(cls):
+    try:
+        return _class_serializers[cls]
+    except KeyError:
+        serialize = _class_serializers[cls] = _compile_serializer(cls)
+        return serialize
+
+# types that are never JsonSerializable, so their values are kept as they
+# are without an isinstance check
+_PLAIN_TYPES = frozenset([
+    types.StringType, types.UnicodeType, types.IntType, types.LongType,
+    types.FloatType, types.BooleanType, types.ListType, types.DictType,
+    types.TupleType,
+])
+
+_SERIALIZE_VALUE = """\
+if v is not None:
+    if type(v) in _plain:
+        d[%(k)s] = v
+    elif isinstance(v, JsonSerializable):
+        d[%(k)s] = v.json()
+    else:
+        d[%(k)s] = v
+"""
+
+def _slot_names(cls):
+    """ The attribute names of the slots of cls and its bases, and whether
+        its instances also have a __dict__ """
+    names = []
+    has_dict = False
+    for klass in inspect.getmro(cls):
+        if klass is object:
+            continue
+        if '__slots__' not in klass.__dict__:
+            has_dict = True
+            continue
+        slots = klass.__dict__['__slots__']
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        for name in slots:
+            if name == '__dict__':
+                has_dict = True
+            elif name == '__weakref__':
+                continue
+            else:
+                if name.startswith('__') and not name.endswith('__'):
+                    name = '_%s%s' % (klass.__name__.lstrip('_'), name)
+                if name not in names:
+                    names.append(name)
+    return names, has_dict
+
+def _compile_serializer(cls):
+    """ Compiles the json() of a JsonSerializable class into one function
+        reading each slot directly, then the instance __dict__ if there is
+        one """
+    slots, has_dict = _slot_names(cls)
+    f = FunctionBuilder('serialize', ['self'], {
+        '_plain': _PLAIN_TYPES,
+        'JsonSerializable': JsonSerializable,
+    })
+    f.add('d = {}')
+    for name in slots:
+        f.add('try:')
+        f.add('v = self.%s' % name, 2)
+        f.add('except AttributeError:')
+        f.add('v = None', 2)
+        f.add(_SERIALIZE_VALUE % {'k': f.const(name)})
+    if has_dict:
+        f.add('for k, v in self.__dict__.iteritems():')
+        f.add(_SERIALIZE_VALUE % {'k': 'k'}, 2)
+    f.add('return d')
+    return f.compile()
+
+
+# datetimes are encoded as their ctime(), which is what nudge has always
+# sent. register_serializer(datetime.datetime, datetime.datetime.isoformat)
+# switches to ISO 8601, which dates use.
+register_serializer(datetime.datetime, datetime.datetime.ctime)
+register_serializer(datetime.date, datetime.date.isoformat)
+register_serializer(datetime.time, datetime.time.isoformat)
+# simplejson writes Decimals itself, as exact numbers. The other backends
+# hand them to this, and a float would lose digits, so they get strings.
+# register_serializer(decimal.Decimal, float) trades precision for numbers.
+register_serializer(decimal.Decimal, str)
+register_serializer(uuid.UUID, str)
+register_serializer(set, list)
+register_serializer(frozenset, list)
+register_serializer(JsonSerializable, JsonSerializable.json)
 
 
 def json_ensure_string_keys(json):
@@ -96,47 +353,136 @@ def hump(match):
     return result
 
 
+# name -> (humped name, dehumped name), cleared when it fills up
+_translations = {}
+TRANSLATION_CACHE_SIZE = 4096
+
+def _translate(name):
+    """ The names Dictomatic tries for an attribute that is not a key """
+    try:
+        return _translations[name]
+    except KeyError:
+        pass
+    if len(_translations) >= TRANSLATION_CACHE_SIZE:
+        _translations.clear()
+    names = _translations[name] = (
+        skyline_case.sub(hump, name), camel_case.sub(dehump, name))
+    return names
+
+_absent = object()
+
+
 class Dictomatic(dict):
     #TODO make sure sub-properties that are dictionaries are dictomatics too
 
+    # alias -> key, for the humped and dehumped names of the keys there were
+    # when wrapped with aliases
+    _aliases = None
+    # how __getattr__ looks a key up, with the one probe of dict.get here
+    _probe = dict.get
+
     @classmethod
-    def wrap(cls, data, decode=True):
+    def wrap(cls, data, decode=True, aliases=False, lazy=False):
+        """ With aliases, each Dictomatic made indexes the other names of
+            its keys, so looking one up by them takes no name translation.
+            After the miss on the name itself, that is a probe of the index
+            and a check and probe of the key it gives, rather than the
+            humped and dehumped names tried in turn.
+
+            With lazy, only the top level is wrapped. Nested dicts are
+            wrapped the first time they are looked up, by key or attribute,
+            so the parts of a large document that are never read are never
+            copied. Iterating over it, values(), items() and copy() give
+            the nested dicts not looked up yet as the plain dicts they were
+            decoded as. """
         if isinstance(data, Dictomatic):
             return data
         if decode and isinstance(data, (types.StringType, types.UnicodeType)):
             data = json_decode(data)
         if isinstance(data, (types.ListType, types.TupleType)):
-            return [Dictomatic.wrap(item) for item in data]
+            return [Dictomatic.wrap(item, aliases=aliases, lazy=lazy)
+                    for item in data]
         elif isinstance(data, types.DictType):
-            data = json_ensure_string_keys(data)
-            for key, value in data.iteritems():
-                if isinstance(value, types.DictType):
-                    data[key] = Dictomatic.wrap(value, decode=False)
-            return Dictomatic(data)
+            if lazy:
+                return _LazyDictomatic._wrap(data, aliases)
+            # one pass making the keys strings and wrapping nested dicts
+            result = Dictomatic([
+                (str(key), Dictomatic.wrap(value, decode=False,
+                    aliases=aliases)
+                    if isinstance(value, types.DictType) else value)
+                for key, value in data.iteritems()])
+            if aliases:
+                result.index_aliases()
+            return result
         elif isinstance(data, types.NoneType):
             return Dictomatic({})
         else:
             raise ValueError('Unexpected type: %s' % type(data))
 
+    def index_aliases(self):
+        """ Indexes the humped and dehumped names of the current keys """
+        index = {}
+        for key in self:
+            for alias in _translate(key):
+                if alias != key and key in _translate(alias):
+                    index[alias] = key
+        self.__dict__['_aliases'] = index
+
     """Makes a dictionary behave like an object with magic dehumping action."""
     def __getattr__(self, name, default=None):
         # try it normally
-        try:
-            return self[name]
-        except KeyError:
-            if name.startswith('__'):
-                raise AttributeError()
-            # try it humped, so camel_case_is_awesome => camelCaseIsAwesome 
-            try:
-                return self[skyline_case.sub(hump, name)]
-            # it's really not here, let them know
-            except KeyError:
-                try:
-                    return self[camel_case.sub(dehump, name)]
-                # it's really not here, let them know
-                except KeyError:
-                    return default
+        value = self._probe(name, _absent)
+        if value is not _absent:
+            return value
+        key = self._find(name)
+        if key is None:
+            # it's really not here
+            return default
+        return self._probe(key)
+
+    def _find(self, name):
+        """ The key an attribute that is not a key itself stands for """
+        if name.startswith('__'):
+            raise AttributeError(name)
+        aliases = self._aliases
+        if aliases:
+            key = aliases.get(name)
+            if key is not None and key in self:
+                return key
+        # try it humped, so camel_case_is_awesome => camelCaseIsAwesome, then
+        # dehumped
+        for key in _translate(name):
+            if key in self:
+                return key
+        return None
 
     def __setattr__(self, name, value):
         self[name] = value
-    
+
+
+class _LazyDictomatic(Dictomatic):
+    """ A Dictomatic wrapping the plain dicts in it when they are looked up,
+        by key, get() or attribute. values(), items(), copy() and iterating
+        return them as plain dicts until then. """
+
+    @classmethod
+    def _wrap(cls, data, aliases):
+        result = cls([(str(k), v) for k, v in data.iteritems()])
+        if aliases:
+            result.index_aliases()
+        return result
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is dict:
+            value = self._wrap(value, self._aliases is not None)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    # attribute lookups wrap too
+    _probe = get
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Incremental JSON decoding, for bodies too large to decode into one tree.
+
+parse() turns an iterable of chunks of a JSON document into a stream of
+(prefix, event, value) tuples, in the format ijson uses: events are
+start_map, map_key, end_map, start_array, end_array, string, number,
+boolean and null, and the prefix is the dotted path to the value, with
+'item' for array elements. ijson does the work when it is installed,
+otherwise a pure python tokenizer does.
+
+items() builds only the values found at one path, so
+
+    for item in items(parse(chunks), 'items.*'):
+        ...
+
+holds a single element of the top level "items" array at a time.
+"""
+
+import re
+
+import nudge.json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+__all__ = [
+    'parse',
+    'items',
+    'path_prefix',
+]
+
+_SCALARS = ('string', 'number', 'boolean', 'null')
+
+def path_prefix(path):
+    """ The event prefix of a path like 'items.*', where '*' stands for
+        every element of an array """
+    if not path:
+        return ''
+    return '.'.join('item' if p == '*' else p for p in path.split('.'))
+
+def parse(chunks):
+    """ Yields the (prefix, event, value) events of the JSON document in
+        chunks, an iterable of byte strings. Raises ValueError if the
+        document is not valid JSON. """
+    if ijson is not None:
+        return _ijson_parse(chunks)
+    return _parse(chunks)
+
+def items(events, path):
+    """ Yields each value at path in the events from parse(), built into
+        the same objects json_decode would give """
+    prefix = path_prefix(path)
+    events = iter(events)
+    for current, event, value in events:
+        if current != prefix:
+            continue
+        if event in _SCALARS:
+            yield value
+        elif event in ('start_map', 'start_array'):
+            yield _build(event, events)
+
+def _build(event, events):
+    root = {} if event == 'start_map' else []
+    stack = [root]
+    keys = [None]
+    for prefix, event, value in events:
+        if event == 'map_key':
+            keys[-1] = value
+            continue
+        if event in ('end_map', 'end_array'):
+            stack.pop()
+            keys.pop()
+            if not stack:
+                return root
+            continue
+        if event == 'start_map':
+            obj = {}
+        elif event == 'start_array':
+            obj = []
+        else:
+            obj = value
+        top = stack[-1]
+        if type(top) is dict:
+            top[keys[-1]] = obj
+        else:
+            top.append(obj)
+        if event in ('start_map', 'start_array'):
+            stack.append(obj)
+            keys.append(None)
+    raise ValueError("incomplete JSON document")
+
+
+class _ChunkReader(object):
+    """ File-like reads over an iterable of chunks, for ijson """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += self._chunks.next()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def _ijson_parse(chunks):
+    try:
+        for prefix, event, value in ijson.parse(_ChunkReader(chunks)):
+            if event == 'number' and not isinstance(value, (int, long)):
+                # ijson gives Decimals, json_decode gives floats
+                value = float(value)
+            yield prefix, event, value
+    except ijson.JSONError, e:
+        raise ValueError(str(e))
+
+
+_WS = re.compile(r'[ \t\n\r]*')
+_TOKEN = re.compile(r'''
+    (?P<punct>[{}\[\]:,])
+   |(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")
+   |(?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)
+   |(?P<literal>true|false|null)
+''', re.VERBOSE)
+# What could still be part of a number or literal cut off by a chunk end
+_PARTIAL = re.compile(r'[0-9A-Za-z.+-]*\Z')
+_LITERALS = {
+    'true': ('boolean', True),
+    'false': ('boolean', False),
+    'null': ('null', None),
+}
+
+# The text of a string token up to an unescaped quote or a backslash ending
+# the text
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+
+def _read_string(head, chunks):
+    """ The string token head starts but does not close, read on from
+        chunks, and the text after it. Only each new chunk is scanned, and
+        the pieces are joined once, so a long string costs linear time. """
+    pieces = []
+    text, start = head, 1
+    while True:
+        end = _STRING_BODY.match(text, start).end()
+        if end < len(text) and text[end] == '"':
+            pieces.append(text[:end + 1])
+            return ''.join(pieces), text[end + 1:]
+        if end < len(text) - 1:
+            raise ValueError("invalid JSON at %r" % text[end:end + 20])
+        pieces.append(text)
+        # a backslash ending the text escapes the next chunk's first char
+        start = len(text) - end
+        text = ''
+        while not text:
+            try:
+                text = chunks.next()
+            except StopIteration:
+                raise ValueError("incomplete JSON document")
+
+def _tokenize(chunks):
+    """ Yields (kind, value) for each token, where kind is the punctuation
+        itself or one of the scalar events """
+    decode = nudge.json._decoder.decode
+    buf = ''
+    pos = 0
+    chunks = iter(chunks)
+    final = False
+    while True:
+        pos = _WS.match(buf, pos).end()
+        match = _TOKEN.match(buf, pos)
+        # A number or literal that runs to the end of the buffer, maybe
+        # past something that cannot end it yet like '-2.', may go on in
+        # the next chunk, unless there is no next chunk.
+        if not final and (match is None or (match.lastgroup in
+                ('number', 'literal') and _PARTIAL.match(buf, match.end()))):
+            if match is None and buf.startswith('"', pos):
+                token, buf = _read_string(buf[pos:], chunks)
+                pos = 0
+                yield 'string', decode(token)
+                continue
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                final = True
+            else:
+                buf = buf[pos:] + chunk
+                pos = 0
+            continue
+        if match is None:
+            if pos < len(buf):
+                raise ValueError("invalid JSON at %r" % buf[pos:pos + 20])
+            return
+        pos = match.end()
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == 'punct':
+            yield token, None
+        elif kind == 'string':
+            yield 'string', decode(token)
+        elif kind == 'number':
+            if '.' in token or 'e' in token or 'E' in token:
+                yield 'number', float(token)
+            else:
+                yield 'number', int(token)
+        else:
+            yield _LITERALS[token]
+
+_VALUE, _VALUE_OR_END, _AFTER_VALUE, _KEY, _KEY_OR_END, _COLON = range(6)
+
+def _child(prefix, name):
+    return prefix + '.' + name if prefix else name
+
+def _parse(chunks):
+    containers = []     # '{' or '[' for each open container
+    prefixes = []       # the prefix of each open container
+    prefix = ''         # the prefix of the next value
+    state = _VALUE
+    for token, value in _tokenize(chunks):
+        if state == _VALUE or state == _VALUE_OR_END:
+            if token == '{':
+                yield prefix, 'start_map', None
+                containers.append('{')
+                prefixes.append(prefix)
+                state = _KEY_OR_END
+            elif token == '[':
+                yield prefix, 'start_array', None
+                containers.append('[')
+                prefixes.append(prefix)
+                prefix = _child(prefix, 'item')
+                state = _VALUE_OR_END
+            elif token in _SCALARS:
+                yield prefix, token, value
+                state = _AFTER_VALUE
+            elif token == ']' and state == _VALUE_OR_END:
+                containers.pop()
+                prefix = prefixes.pop()
+                yield prefix, 'end_array', None
+                state = _AFTER_VALUE
+            else:
+                raise ValueError("expected a value, found %r" % token)
+        elif state == _AFTER_VALUE:
+            if not containers:
+                raise ValueError("extra data after the JSON document")
+            container = containers[-1]
+            if token == ',':
+                if container == '{':
+                    state = _KEY
+                else:
+                    prefix = _child(prefixes[-1], 'item')
+                    state = _VALUE
+            elif (token == '}' and container == '{') or \
+                 (token == ']' and container == '['):
+                containers.pop()
+                prefix = prefixes.pop()
+                yield prefix, 'end_map' if token == '}' else 'end_array', None
+            else:
+                raise ValueError("expected ',' or a close, found %r" % token)
+        elif state == _KEY or state == _KEY_OR_END:
+            if token == 'string':
+                yield prefixes[-1], 'map_key', value
+                prefix = _child(prefixes[-1], value)
+                state = _COLON
+            elif token == '}' and state == _KEY_OR_END:
+                containers.pop()
+                prefix = prefixes.pop()
+                yield prefix, 'end_map', None
+                state = _AFTER_VALUE
+            else:
+                raise ValueError("expected a key, found %r" % token)
+        else:
+            if token != ':':
+                raise ValueError("expected ':', found %r" % token)
+            state = _VALUE
+    if containers or state != _AFTER_VALUE:
+        raise ValueError("incomplete JSON document")
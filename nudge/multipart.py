@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Incremental multipart/form-data parser.
+
+The body is fed in chunks as it is read from the client. Plain fields are
+kept in memory, file parts are written to spooled temporary files as they
+arrive, so the largest thing held in memory is one chunk plus the spool
+threshold of each file.
+
+    parser = MultipartParser(boundary)
+    for chunk in chunks:
+        parser.feed(chunk)
+    fields, files = parser.close()
+
+fields maps each name to a list of byte string values. files maps each
+name to a list of dicts with the filename, content_type, headers and body,
+which is a file object positioned at the start of the upload. If the body
+cannot be read to the end, abort() closes the files of the parts so far.
+"""
+
+import cgi
+import tempfile
+
+from nudge.error import HTTPException
+
+__all__ = [
+    'MultipartParser',
+    'get_boundary',
+]
+
+_PREAMBLE, _DELIMITER, _HEADERS, _BODY, _END = range(5)
+
+def get_boundary(content_type):
+    """ The boundary parameter of a multipart Content-Type header. Fails
+        with a 400 if it is missing or not a valid boundary. """
+    ctype, params = cgi.parse_header(content_type)
+    boundary = params.get('boundary', '')
+    if not 0 < len(boundary) <= 70:
+        raise HTTPException(400, "invalid multipart boundary")
+    return boundary
+
+
+class MultipartParser(object):
+
+    def __init__(self, boundary, spool_size=1024 * 1024,
+                 max_field_size=1024 * 1024, max_header_size=16 * 1024,
+                 max_parts=1000):
+        # The CRLF before a delimiter belongs to the delimiter, and a
+        # leading one lets the first delimiter be found the same way.
+        self._delimiter = '\r\n--' + boundary
+        self._buffer = '\r\n'
+        self._state = _PREAMBLE
+        self.spool_size = spool_size
+        self.max_field_size = max_field_size
+        self.max_header_size = max_header_size
+        self.max_parts = max_parts
+        self.fields = {}
+        self.files = {}
+        self._parts = 0
+        self._part = None
+
+    def feed(self, data):
+        """ Parses the next chunk of the body """
+        self._buffer += data
+        try:
+            while self._step():
+                pass
+        except:
+            self.abort()
+            raise
+
+    def close(self):
+        """ Finishes parsing and returns (fields, files) """
+        if self._state != _END:
+            self.abort()
+            raise HTTPException(400, "incomplete multipart body")
+        for parts in self.files.itervalues():
+            for part in parts:
+                part['body'].seek(0)
+        return self.fields, self.files
+
+    def _step(self):
+        """ Consumes what it can of the buffer in the current state.
+            Returns False once more data is needed. """
+        buf = self._buffer
+        delimiter = self._delimiter
+        if self._state == _PREAMBLE:
+            i = buf.find(delimiter)
+            if i < 0:
+                self._buffer = buf[-len(delimiter):]
+                return False
+            self._buffer = buf[i + len(delimiter):]
+            self._state = _DELIMITER
+        elif self._state == _DELIMITER:
+            buf = buf.lstrip(' \t')
+            if len(buf) < 2:
+                self._buffer = buf
+                return False
+            if buf.startswith('--'):
+                self._buffer = ''
+                self._state = _END
+                return False
+            if not buf.startswith('\r\n'):
+                raise HTTPException(400, "invalid multipart delimiter")
+            self._buffer = buf[2:]
+            self._state = _HEADERS
+        elif self._state == _HEADERS:
+            if buf.startswith('\r\n'):
+                end, headers = 0, ''
+            else:
+                end = buf.find('\r\n\r\n')
+                if end < 0:
+                    if len(buf) > self.max_header_size:
+                        raise HTTPException(400, "multipart headers too long")
+                    return False
+                headers = buf[:end]
+                end += 2
+            self._buffer = buf[end + 2:]
+            self._start_part(headers)
+            self._state = _BODY
+        elif self._state == _BODY:
+            i = buf.find(delimiter)
+            if i < 0:
+                # keep enough to find a delimiter split across chunks
+                keep = len(delimiter) - 1
+                if len(buf) > keep:
+                    self._write(buf[:-keep])
+                    self._buffer = buf[-keep:]
+                return False
+            self._write(buf[:i])
+            self._finish_part()
+            self._buffer = buf[i + len(delimiter):]
+            self._state = _DELIMITER
+        else:
+            # the epilogue is ignored
+            self._buffer = ''
+            return False
+        return True
+
+    def _start_part(self, headers):
+        self._parts += 1
+        if self._parts > self.max_parts:
+            raise HTTPException(400, "too many multipart parts")
+        parsed = {}
+        for line in headers.split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                parsed[name.strip().lower()] = value.strip()
+        disposition, params = cgi.parse_header(
+            parsed.get('content-disposition', ''))
+        name = params.get('name')
+        filename = params.get('filename')
+        if name is None:
+            part = {'name': None, 'size': 0}
+        elif filename is not None:
+            part = {
+                'name': name,
+                'filename': filename,
+                'content_type': parsed.get(
+                    'content-type', 'application/octet-stream'),
+                'headers': parsed,
+                'body': tempfile.SpooledTemporaryFile(
+                    max_size=self.spool_size),
+            }
+        else:
+            part = {'name': name, 'size': 0, 'chunks': []}
+        self._part = part
+
+    def _write(self, data):
+        part = self._part
+        if not data or part['name'] is None:
+            return
+        if 'body' in part:
+            part['body'].write(data)
+        else:
+            part['size'] += len(data)
+            if part['size'] > self.max_field_size:
+                raise HTTPException(413, "multipart field too large")
+            part['chunks'].append(data)
+
+    def _finish_part(self):
+        part, self._part = self._part, None
+        name = part.pop('name')
+        if name is None:
+            return
+        if 'body' in part:
+            self.files.setdefault(name, []).append(part)
+        else:
+            self.fields.setdefault(name, []).append(''.join(part['chunks']))
+
+    def abort(self):
+        """ Closes the temporary files of a body that failed to parse """
+        if self._part is not None and 'body' in self._part:
+            self._part['body'].close()
+        for parts in self.files.itervalues():
+            for part in parts:
+                part['body'].close()
+        self._part = None
+        self._state = _END
@@ -68,40 +68,48 @@ class ProjectSection(object):
 
     def prepare_data(self):
         """ Copy and sanitize all useful data from the endpoints and
-            options into friendlier locations """
+            options into friendlier locations. Endpoints and args have no
+            room for extra fields, so endpoints are replaced with
+            documentation wrappers that carry them. """
+        endpoints = []
         for ep in self.endpoints:
+            doc = _Documented(ep)
             # Function string
             if callable(ep.function):
-                ep.function_name = ep.function.__name__
-                ep.function_info = ep.function.__doc__ or ""
+                doc.function_name = ep.function.__name__
+                doc.function_info = ep.function.__doc__ or ""
             elif isinstance(ep.function, str):
-                ep.function_name = ep.function
-                ep.function_info = ep.function
+                doc.function_name = ep.function
+                doc.function_info = ep.function
             # Combine args and inargs into a nice informative list
-            ep.args_list = []
-            for arg in ep.sequential:
-                ep.args_list.append(arg)
-            for name, arg in ep.named.items():
-                ep.args_list.append(arg)
-
-            for arg in ep.args_list:
+            doc.args_list = []
+            for arg in ep.sequential + ep.named.values():
+                arg_doc = _Documented(arg)
                 # Just make sure all standard properties exist
-                if not hasattr(arg, "default"):
-                    arg.default = None
-                if not hasattr(arg, "optional"):
-                    arg.optional = None
-                if not hasattr(arg, "validator"):
-                    arg.validator = None
-                if arg.validator:
-                    arg.validator_name = arg.validator.__name__
-                    arg.validator_info = arg.validator.__doc__ or ""
+                arg_doc.default = getattr(arg, "default", None)
+                arg_doc.optional = getattr(arg, "optional", None)
+                arg_doc.validator = getattr(arg, "validator", None)
+                if arg_doc.validator:
+                    arg_doc.validator_name = arg_doc.validator.__name__
+                    arg_doc.validator_info = arg_doc.validator.__doc__ or ""
                 else:
-                    arg.validator_name = ""
-                    arg.validator_info = ""
-                arg.info = arg.__doc__ or ""
-            ep.renderer_name = ep.renderer.__class__.__name__
-            ep.renderer_info = ep.renderer.__doc__ or ""
+                    arg_doc.validator_name = ""
+                    arg_doc.validator_info = ""
+                arg_doc.info = arg.__doc__ or ""
+                doc.args_list.append(arg_doc)
+            doc.renderer_name = ep.renderer.__class__.__name__
+            doc.renderer_info = ep.renderer.__doc__ or ""
             # TODO exceptions and exception handlers...
+            endpoints.append(doc)
+        self.endpoints = endpoints
+
+class _Documented(object):
+    """ Wraps an endpoint or arg, reading through to it for anything not
+        set on the wrapper """
 
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
 
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
 
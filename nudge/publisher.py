@@ -20,49 +20,117 @@ import cgi
 import logging
 import re
 import sys
+import tempfile
 import types
 import time
 import types
 import urllib
 import warnings
-import cStringIO as StringIO
 
 import nudge.json
 import nudge.log
 import nudge.arg as args
+from nudge.arg import compile_binder
+from nudge.compression import Inflater
+from nudge.headers import WSGIHeaders
+from nudge.jsonstream import parse as parse_json, items as json_items
+from nudge.multipart import MultipartParser, get_boundary
 from nudge.renderer import Json, RequestAwareRenderer
+from nudge.router import Router, compile_template, _has_top_level_branch
+from nudge.redos import check_endpoint
+from nudge.utils import LazySlots, lazyprop, is_computed
 from nudge.validator import ValidationError
 from nudge.json import Dictomatic
 from nudge.error import handle_exception, HTTPException, JsonErrorHandler,\
     DEFAULT_ERROR_CODE, DEFAULT_ERROR_CONTENT_TYPE, DEFAULT_ERROR_CONTENT, responses
 
+try:
+    from eventlet.timeout import Timeout as _GreenTimeout
+except ImportError:
+    _GreenTimeout = None
+
 _log = logging.getLogger("nudge.publisher")
 
+# How much of the body is read from wsgi.input at a time
+BODY_CHUNK_SIZE = 64 * 1024
+
 __all__ = [
     'Args',
+    'ArgumentView',
     'Endpoint',
+    'Environ',
     'WSGIRequest',
     'ServicePublisher',
+    'parse_query_string',
 ]
 
-def lazyprop(fn):
-    attr_name = '_lazy_' + fn.__name__
-    @property
-    def _lazyprop(self):
-        if not hasattr(self, attr_name):
-            setattr(self, attr_name, fn(self))
-        return getattr(self, attr_name)
-    return _lazyprop
+def _unquote_piece(s):
+    # most names and values have nothing escaped
+    if '%' in s or '+' in s:
+        s = urllib.unquote_plus(s)
+    return unicode(s, 'utf-8')
+
+def parse_query_string(qs, max_params=None, max_key_length=None):
+    """ Parses a query string into a dict of unicode name -> list of
+        unicode values. Pairs are split on '&' and then on the first '='
+        before anything is unescaped, so escaped '&' and '=' stay in the
+        names and values. Pairs without a '=' are skipped. More than
+        max_params pairs, or a name longer than max_key_length, fail with a
+        400, which keeps a request from filling the dict with colliding
+        keys. Raises UnicodeDecodeError if a name or value is not UTF-8. """
+    arguments = {}
+    if not qs:
+        return arguments
+    if isinstance(qs, unicode):
+        qs = qs.encode('utf-8')
+    if max_params is not None and qs.count('&') >= max_params:
+        raise HTTPException(400, "too many query parameters")
+    if '%26' in qs or '%3D' in qs or '%3d' in qs:
+        # unescape each name and value on its own
+        pairs = qs.split('&')
+        unquote = _unquote_piece
+    else:
+        # nothing unescapes to a separator, so the whole string can be
+        # unescaped and decoded in one go, which is much cheaper than
+        # doing it per piece
+        pairs = unicode(urllib.unquote_plus(qs), 'utf-8').split(u'&')
+        unquote = None
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            continue
+        if max_key_length is not None and len(key) > max_key_length:
+            raise HTTPException(400, "query parameter name too long")
+        if unquote is not None:
+            key = unquote(key)
+            value = unquote(value)
+        values = arguments.get(key)
+        if values is None:
+            arguments[key] = [value]
+        else:
+            values.append(value)
+    return arguments
+
+def _decode_line(line, number):
+    try:
+        return nudge.json.json_decode(line)
+    except (ValueError):
+        raise HTTPException(400, "line %d of the body is not JSON" % number)
 
 def Args(*args, **kwargs):
     return list(args) or [], kwargs or {}
 
 class Endpoint(object):
-    sequential = []
-    named = {}
+    __slots__ = (
+        'name', 'method', 'uris', 'function', 'max_body_size',
+        'sequential', 'named', 'bind', 'exceptions', 'renderer',
+        'path_converters', 'regexs', 'path_regexs', 'body_args',
+        'redos_report',
+    )
 
     def __init__(self, name=None, method=None, uri=None, uris=None, 
-                 function=None, args=None, exceptions=None, renderer=None):
+                 function=None, args=None, exceptions=None, renderer=None,
+                 max_body_size=None):
         # Someday support unicode here, for now only bytestrings.
         assert isinstance(name, str)
         assert isinstance(method, str)
@@ -75,11 +143,17 @@ class Endpoint(object):
         assert not exceptions or isinstance(exceptions, dict), \
             "exceptions must be a dict, but was type %s" % type(exceptions)
         # TODO maybe do some more checking on exceptions
+        assert max_body_size is None or \
+            (isinstance(max_body_size, int) and max_body_size >= 0), \
+            "max_body_size must be None or an int >= 0"
 
         self.name = name
         self.method = method
         self.uris = [uri] if uri else uris
         self.function = function
+        # overrides the publisher's max_body_size option for this endpoint
+        self.max_body_size = max_body_size
+        self.sequential, self.named = [], {}
         if args:
             self.sequential, self.named = args
             assert not self.sequential or isinstance(self.sequential, list), \
@@ -87,6 +161,13 @@ class Endpoint(object):
                 type(self.sequential)
             assert not self.named or isinstance(self.named, dict), \
                 "named must be a dict, but was type %s" % type(self.named)
+        # args are compiled once here into a single binding function
+        self.bind = compile_binder(self.sequential, self.named)
+        # the body can only be streamed once
+        streams = [a for a in self.sequential + self.named.values()
+                   if getattr(a, 'streams_body', False)]
+        assert len(streams) <= 1, \
+            "Endpoint %s has more than one arg streaming the body" % name
 
         self.exceptions = exceptions
         if renderer:
@@ -102,7 +183,40 @@ class Endpoint(object):
         else:
             # Nudge default renderer
             self.renderer = Json()
-        self.regexs = [re.compile(self.method + uri) for uri in self.uris]
+        # uris are either regexes or templates like '/users/{id:int}',
+        # which compile to a regex plus converters for the typed fields.
+        patterns = []
+        self.path_converters = []
+        for uri in self.uris:
+            template = compile_template(uri)
+            if template:
+                uri, converters = template
+            else:
+                converters = None
+            patterns.append(uri)
+            self.path_converters.append(converters)
+            for arg in self.sequential + self.named.values():
+                assert not (converters and isinstance(arg, _TEXT_ARGS) and
+                            arg.name in converters), \
+                    "arg '%s' of endpoint %s takes text, but {%s} of %s " \
+                    "is converted" % (arg.name, name, arg.name, uri)
+        # A top level '|' would otherwise leave all but the first
+        # alternative without the method in front of it.
+        patterns = ['(?:%s)' % p if _has_top_level_branch(p) else p
+                    for p in patterns]
+        self.regexs = [re.compile(self.method + p) for p in patterns]
+        self.path_regexs = [re.compile(p) for p in patterns]
+        # Whether binding may look args up in the body. Not when every arg
+        # is a path parameter of every uri, which path args always give, so
+        # the body of a request to such an endpoint is never parsed for
+        # args, and not when an arg streams the body, which decoding it
+        # whole to look for args would undo.
+        path_names = reduce(lambda a, b: a & b,
+            [set(r.groupindex) for r in self.path_regexs])
+        self.body_args = not streams and _needs_body_args(
+            self.sequential + self.named.values(), path_names)
+        # what the publisher's redos check found, see add_endpoint
+        self.redos_report = None
 
     def match(self, reqline):
         for regex in self.regexs:
@@ -114,50 +228,432 @@ class Endpoint(object):
     def __call__(self, *args, **kwargs):
         return self.function(*args, **kwargs)
 
+# standard args whose validators expect the text of a value, which a uri
+# template field with a converter does not give them
+_TEXT_ARGS = (args.String, args.Date, args.Json, args.Action)
+
+def _needs_body_args(endpoint_args, path_names):
+    for arg in endpoint_args:
+        if isinstance(arg, args.CustomArg):
+            if arg.reads_inargs:
+                return True
+        elif arg.name not in path_names:
+            return True
+    return False
+
 def _write(req, content):
     req._buffer += content
 
 
-class WSGIHeaders(dict):
+_absent = object()
+
+class ArgumentView(object):
+    """ Read-only view of everywhere an endpoint arg can come from, without
+        copying any of them. Path args come first, so a body or query
+        string field can never change which resource the path names. Then
+        JSON body fields, query string args and form body args, in the
+        order nudge has always merged them in (multipart ones come before
+        the query string, which they used to replace). With body=False,
+        for an endpoint whose args cannot come from the body or whose body
+        is streamed, the body layers are skipped. Layers are only parsed
+        when a lookup reaches them. A request that is not a WSGIRequest
+        has its arguments dict after the path args instead.
+
+        lookup() returns values as they are stored (lists for query and form
+        encoded args). Item access, get() and the other read methods of a
+        dict return the first value of those lists instead, like the scalar
+        dict args used to resolve against. Iterating over it parses every
+        layer.
+
+        Path args named in typed (by default the typed attribute of a
+        nudge.router.PathArgs) were produced by a uri template converter,
+        which lookup_typed() reports so binding does not take a converted 0
+        for an empty arg. """
+
+    __slots__ = ('_req', '_path_args', '_typed', '_body')
+
+    def __init__(self, req, path_args, typed=None, body=True):
+        self._req = req
+        self._path_args = path_args
+        if typed is None:
+            typed = getattr(path_args, 'typed', ())
+        self._typed = typed
+        self._body = body
+
+    def _layers(self):
+        req = self._req
+        yield self._path_args, False, self._typed
+        if not isinstance(req, WSGIRequest):
+            # other requests only have their args merged into one dict
+            yield req.arguments, True, ()
+            return
+        multipart = False
+        if self._body:
+            yield req.json_arguments, False, ()
+            multipart = req.headers.lookup('content_type', '').startswith(
+                'multipart/form-data')
+            if multipart:
+                yield req.form_arguments, True, ()
+        yield req.query_arguments, True, ()
+        if self._body and not multipart:
+            yield req.form_arguments, True, ()
+
+    def lookup(self, name, default=None):
+        for layer, multi, typed in self._layers():
+            if name in layer:
+                return layer[name]
+        return default
+
+    def lookup_typed(self, name, default=None):
+        """ (value, typed) for name, where typed is True if the value is a
+            path arg a converter produced """
+        for layer, multi, typed in self._layers():
+            if name in layer:
+                return layer[name], name in typed
+        return default, False
+
+    def __contains__(self, name):
+        return self.lookup(name, _absent) is not _absent
+
+    def __getitem__(self, name):
+        for layer, multi, typed in self._layers():
+            if name in layer:
+                value = layer[name]
+                if multi and isinstance(value, list):
+                    if not value:
+                        raise KeyError(name)
+                    return value[0]
+                return value
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """ The names in every layer, in the order they are looked in """
+        seen = set()
+        names = []
+        for layer, multi, typed in self._layers():
+            for name in layer:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
 
-    def __init__(self, *args, **kwargs):
-        super(WSGIHeaders, self).__init__()
-        self.update(*args, **kwargs)
+
+class Environ(object):
+    """ Read-only view of a WSGI environ with attribute access. Wraps the
+        server's dict in place instead of copying it, and only wraps nested
+        dicts when they are looked up. Like Dictomatic, attributes that are
+        not in the environ are None. """
+
+    __slots__ = ('_environ',)
+
+    def __init__(self, environ):
+        if isinstance(environ, Environ):
+            environ = environ._environ
+        self._environ = environ
+
+    def _wrap(self, value):
+        if isinstance(value, types.DictType):
+            return Environ(value)
+        return value
 
     def __getitem__(self, key):
-        return super(WSGIHeaders, self).__getitem__(
-            WSGIHeaders.normalize_name(key)
-        )
+        return self._wrap(self._environ[key])
 
-    def __setitem__(self, key, value):
-        return super(WSGIHeaders, self).__setitem__(
-            WSGIHeaders.normalize_name(key), value
-        )
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.get(name)
 
     def get(self, key, default=None):
-        return super(WSGIHeaders, self).get(
-            WSGIHeaders.normalize_name(key), default
-        )
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
-    def set(self, key, value):
-        return super(WSGIHeaders, self).set(
-            WSGIHeaders.normalize_name(key), value
-        )
+    def __contains__(self, key):
+        return key in self._environ
+
+    def __iter__(self):
+        return iter(self._environ)
+
+    def __len__(self):
+        return len(self._environ)
+
+    def keys(self):
+        return self._environ.keys()
+
+    def iteritems(self):
+        for k, v in self._environ.iteritems():
+            yield k, self._wrap(v)
 
-    @staticmethod
-    def normalize_name(n):
-        return n.lower().replace('-','_')
+    def items(self):
+        return list(self.iteritems())
 
+    def __repr__(self):
+        return 'Environ(%r)' % (self._environ,)
 
-class WSGIRequest(object):
+
+# Request limits, which the ServicePublisher sets from its options
+DEFAULT_BODY_SPOOL_SIZE = 1024 * 1024
+DEFAULT_MAX_QUERY_PARAMS = 1000
+DEFAULT_MAX_QUERY_KEY_LENGTH = 256
+DEFAULT_MAX_COMPRESSION_RATIO = 100
+
+class WSGIRequest(LazySlots):
+
+    # lazyprops below get slots of their own
+    __slots__ = (
+        'req', 'start_time', 'method', 'remote_ip', '_body', '_buffer',
+        'max_body_size', 'body_spool_size', 'body_timeout',
+        'max_compression_ratio', '_streamed',
+        'max_query_params', 'max_query_key_length',
+    )
 
     def __init__(self, req_dict):
-        self.req = Dictomatic.wrap(req_dict)
+        self.req = Environ(req_dict)
         self.start_time = time.time()
         self.method = self.req['REQUEST_METHOD']
         self.remote_ip = self.req['REMOTE_ADDR']
-        self.body = self.req['wsgi.input'].read()
+        self._body = None
+        self._streamed = False
         self._buffer = ''
+        # Body limits. The ServicePublisher sets these from its options and
+        # the matched endpoint before anything reads the body.
+        self.max_body_size = None
+        self.body_spool_size = DEFAULT_BODY_SPOOL_SIZE
+        self.body_timeout = None
+        self.max_compression_ratio = DEFAULT_MAX_COMPRESSION_RATIO
+        self.max_query_params = DEFAULT_MAX_QUERY_PARAMS
+        self.max_query_key_length = DEFAULT_MAX_QUERY_KEY_LENGTH
+
+    def _get_body(self):
+        # Only read once something needs the body, which for a request to
+        # an unknown route or a path args only endpoint is never. This holds
+        # the whole body in memory; nudge itself decodes bodies from
+        # body_stream or iter_body() instead.
+        if self._body is None:
+            self._body = self._read_spool()
+        return self._body
+
+    def _set_body(self, body):
+        self._body = body
+
+    body = property(_get_body, _set_body)
+
+    def _read_spool(self):
+        """ The whole of body_stream, however much of it has been read,
+            leaving its position where it was """
+        stream = self.body_stream
+        position = stream.tell()
+        stream.seek(0)
+        try:
+            return stream.read()
+        finally:
+            stream.seek(position)
+
+    @lazyprop
+    def content_length(self):
+        """ The Content-Length header as an int, or None if not sent """
+        length = self.req.get('CONTENT_LENGTH')
+        if length in (None, ''):
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            raise HTTPException(400, "invalid Content-Length")
+        if length < 0:
+            raise HTTPException(400, "invalid Content-Length")
+        return length
+
+    def check_content_length(self):
+        """ Fails with a 413 before reading anything if the declared
+            Content-Length is over max_body_size """
+        length = self.content_length
+        if self.max_body_size is not None and length is not None and \
+           length > self.max_body_size:
+            raise HTTPException(413)
+
+    def _read(self, source, size, deadline):
+        """ One read from wsgi.input, failing with a 408 past deadline """
+        if deadline is None:
+            return source.read(size) if size else source.read()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise HTTPException(408)
+        # A green timeout interrupts a read blocked on a stalled socket.
+        # It only runs for the read, as the body may be streamed to an
+        # endpoint that does its own work between chunks.
+        timer = _GreenTimeout(remaining) if _GreenTimeout else None
+        try:
+            chunk = source.read(size) if size else source.read()
+        except:
+            # the green timeout is not an Exception subclass
+            if timer is not None and sys.exc_info()[1] is timer:
+                raise HTTPException(408)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if time.time() > deadline:
+            raise HTTPException(408)
+        return chunk
+
+    def _read_body(self):
+        """ Yields the body from wsgi.input in chunks, as sent. Fails with a
+            413 past max_body_size and a 408 if it takes longer than
+            body_timeout seconds. """
+        if self._streamed:
+            # A programming error rather than a bad request: something
+            # asked for the body after it was streamed to an endpoint.
+            # Endpoints are refused at registration if two of their args
+            # would stream it.
+            raise RuntimeError("the request body was streamed and can not "
+                               "be read again")
+        self._streamed = True
+        self.check_content_length()
+        limit = self.max_body_size
+        remaining = self.content_length
+        source = self.req['wsgi.input']
+        deadline = None
+        if self.body_timeout is not None:
+            deadline = time.time() + self.body_timeout
+        size = 0
+        while remaining is None or remaining > 0:
+            if remaining is not None:
+                chunk = self._read(
+                    source, min(BODY_CHUNK_SIZE, remaining), deadline)
+            elif limit is not None:
+                chunk = self._read(source, BODY_CHUNK_SIZE, deadline)
+            else:
+                # No length and no limit, so read it the way it always
+                # was; not every wsgi.input takes a size without one.
+                chunk = self._read(source, None, deadline)
+                # ends the loop once this chunk is passed on
+                remaining = len(chunk)
+            if not chunk:
+                break
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise HTTPException(413)
+            yield chunk
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    def _inflate_body(self):
+        """ Yields the body from wsgi.input in chunks, inflating a gzip or
+            deflate Content-Encoding. Fails with a 413 past max_body_size
+            inflated bytes or max_compression_ratio. """
+        chunks = self._read_body()
+        encoding = self.headers.lookup('content_encoding', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return chunks
+        return self._inflate(chunks, encoding)
+
+    def _inflate(self, chunks, encoding):
+        out = []
+        inflater = Inflater(encoding, out.append,
+            max_size=self.max_body_size,
+            max_ratio=self.max_compression_ratio,
+            chunk_size=BODY_CHUNK_SIZE,
+        )
+        for chunk in chunks:
+            inflater.feed(chunk)
+            for data in out:
+                yield data
+            del out[:]
+        inflater.close()
+
+    def iter_body(self):
+        """ Yields the body in chunks. Unless something has already read
+            the body they come straight from wsgi.input and are not kept,
+            which can only be done once per request. """
+        if self._body is not None:
+            return iter([self._body] if self._body else [])
+        if is_computed(self, 'body_stream'):
+            return self._iter_spool()
+        return self._inflate_body()
+
+    def _iter_spool(self):
+        stream = self.body_stream
+        stream.seek(0)
+        return iter(lambda: stream.read(BODY_CHUNK_SIZE), '')
+
+    def iter_ndjson(self):
+        """ Yields the records of a newline delimited JSON body one at a
+            time, decoding each line as it arrives, so the body is never
+            held whole. Blank lines are skipped. A line that is not JSON
+            fails with a 400. """
+        pending = []
+        number = 0
+        for chunk in self.iter_body():
+            lines = chunk.split('\n')
+            if len(lines) == 1:
+                pending.append(chunk)
+                continue
+            pending.append(lines[0])
+            lines[0] = ''.join(pending)
+            pending = [lines.pop()]
+            for line in lines:
+                number += 1
+                if line.strip():
+                    yield _decode_line(line, number)
+        line = ''.join(pending)
+        if line.strip():
+            yield _decode_line(line, number + 1)
+
+    def iter_json(self, path):
+        """ Yields the values at path in a JSON body, 'items.*' being each
+            element of its top level "items" array, decoding the body as it
+            arrives. Only one value is built at a time, never the whole
+            document. A body that is not JSON fails with a 400, which may
+            come after values before the error have been yielded. """
+        try:
+            for value in json_items(parse_json(self.iter_body()), path):
+                yield value
+        except (ValueError):
+            raise HTTPException(400, "body is not JSON")
+
+    @lazyprop
+    def body_stream(self):
+        """ The body as a file object positioned at the start. It is kept
+            in memory up to body_spool_size bytes and spooled to a
+            temporary file beyond that, so holding it costs the same
+            whatever the size of the upload. """
+        spool = tempfile.SpooledTemporaryFile(max_size=self.body_spool_size)
+        try:
+            for chunk in self._inflate_body():
+                spool.write(chunk)
+        except:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
 
     @lazyprop
     def path(self):
@@ -173,68 +669,145 @@ class WSGIRequest(object):
 
     @lazyprop
     def headers(self):
-        _headers = WSGIHeaders()
-        for k,v in self.req.iteritems():
-            if k.startswith('HTTP_'):
-                _headers[k.replace('HTTP_', '').lower()] = v
-            elif k == 'CONTENT_TYPE':
-                _headers['Content-Type'] = v
-        return _headers
+        return WSGIHeaders.from_environ(self.req._environ)
 
     @lazyprop
-    def arguments(self):
+    def query_arguments(self):
+        """ QUERY_STRING args, as a dict of name -> list of values """
         _arguments = {}
         try:
-            # First url decode
-            tmp = self.req.get('QUERY_STRING', '')
-            if tmp:
-                # First url unescape and make unicode. Consider making the
-                # unicode decoding type a Nudge option.
-                tmp = unicode(urllib.unquote_plus(tmp), encoding="utf-8")
-                tmp = tmp.split('&')
-                tmp = [a.split('=') for a in tmp]
-                # Only keep args with k and v. f= will stay and be [u'f', u'']
-                tmp = filter(lambda x: len(x) == 2, tmp)
-                for a in tmp:
-                    if a[0] in _arguments:
-                        _arguments[a[0]].append(a[1])
-                    else:
-                        _arguments[a[0]] = [a[1]]
+            # Consider making the unicode decoding type a Nudge option.
+            _arguments = parse_query_string(
+                self.req.get('QUERY_STRING', ''),
+                self.max_query_params,
+                self.max_query_key_length,
+            )
+        except HTTPException:
+            raise
         except (Exception), e:
             _log.exception(
                 "problem making arguments out of QUERY_STRING: %s",
                 self.req['QUERY_STRING']
             )
+        return _arguments
 
-        if self.method in ('POST', 'PUT') and self.body:
-            content_type = self.headers.get("Content-Type", '')
-            # TODO make sure these come out as unicode
-            if content_type.startswith("application/x-www-form-urlencoded"):
-                for name, values in cgi.parse_qs(self.body).iteritems():
-                    _arguments.setdefault(name, []).extend(values)
-            # multipart form
-            elif content_type.startswith("multipart/form-data"):
-                try:
-                    fs = cgi.FieldStorage(
-                        fp=StringIO.StringIO(self.body),
-                        environ=self.req,
-                        keep_blank_values=1
-                    )
-                    for k in fs.keys():
-                        _arguments[k] = fs[k].value
-                except:
-                    _log.exception(
-                        "problem parsing multipart/form-data"
-                    )
-            # add any arguments from JSON body
-            elif content_type.startswith("application/json"):
-                try:
-                    body = nudge.json.json_decode(self.body)
-                    if isinstance(body, types.DictType):
-                        _arguments = dict(_arguments, **body)
+    def _has_body(self):
+        """ Whether there may be a body. Without a Content-Length only
+            reading it would tell, so that counts as maybe, and whatever
+            parses the body copes with an empty one. """
+        if self._body is not None:
+            return bool(self._body)
+        return self.content_length is None or self.content_length > 0
+
+    def _body_content_type(self):
+        if self.method in ('POST', 'PUT') and self._has_body():
+            return self.headers.lookup("content_type", '')
+        return ''
 
-                except (ValueError):
-                    raise HTTPException(400, "body is not JSON")
+    @lazyprop
+    def form_arguments(self):
+        """ Args from a form encoded or multipart body, as a dict of
+            name -> list of values. Multipart file parts are in files, not
+            here, so their contents are not loaded as args. """
+        _arguments = {}
+        content_type = self._body_content_type()
+        # TODO make sure these come out as unicode
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            _arguments = self._parse_form()
+        # multipart form
+        elif content_type.startswith("multipart/form-data"):
+            _arguments = self._multipart[0]
+        return _arguments
+
+    def _parse_form(self):
+        """ Parses a form encoded body like cgi.parse_qs, a chunk at a
+            time from body_stream, so only the parsed args are ever held
+            whole and the body can still be read afterwards """
+        if self._body is not None:
+            chunks = [self._body]
+        else:
+            chunks = self._iter_spool()
+        _arguments = {}
+        pending = ''
+        for chunk in chunks:
+            pairs, sep, pending = (pending + chunk).rpartition('&')
+            for name, value in cgi.parse_qsl(pairs):
+                _arguments.setdefault(name, []).append(value)
+        for name, value in cgi.parse_qsl(pending):
+            _arguments.setdefault(name, []).append(value)
+        return _arguments
+
+    @lazyprop
+    def files(self):
+        """ The file parts of a multipart body, as a dict of name -> list
+            of dicts with the filename, content_type, headers and body of
+            each upload. body is a file object. """
+        if self._body_content_type().startswith("multipart/form-data"):
+            return self._multipart[1]
+        return {}
+
+    @lazyprop
+    def _multipart(self):
+        """ (fields, files) parsed from a multipart body. The body is fed
+            to the parser straight from wsgi.input unless something has
+            already read it. """
+        parser = MultipartParser(
+            get_boundary(self.headers.lookup("content_type", '')),
+            spool_size=self.body_spool_size,
+        )
+        empty = True
+        try:
+            for chunk in self.iter_body():
+                empty = empty and not chunk
+                parser.feed(chunk)
+        except:
+            # eg. a 413 or 408 from reading the body
+            parser.abort()
+            raise
+        if empty:
+            # no body after all, which had no Content-Length to say so
+            return {}, {}
+        return parser.close()
+
+    @lazyprop
+    def json_body(self):
+        """ The body decoded as JSON, whatever its content type, or None
+            if there is no body. Everything that needs the decoded body
+            shares this, so it is decoded at most once. The raw body is
+            only held for the decode, not kept alongside the result. """
+        body = self._body
+        if body is None:
+            body = self._read_spool()
+        if not body:
+            return None
+        try:
+            return nudge.json.json_decode(body)
+        except (ValueError):
+            raise HTTPException(400, "body is not JSON")
+
+    @lazyprop
+    def json_arguments(self):
+        """ The top level fields of a JSON object body """
+        if self._body_content_type().startswith("application/json"):
+            body = self.json_body
+            if isinstance(body, types.DictType):
+                return body
+        return {}
+
+    @lazyprop
+    def arguments(self):
+        """ All query string and body args merged into one dict. Nudge
+            itself resolves args through an ArgumentView, which does not
+            need this copy. """
+        _arguments = dict(
+            (k, list(v)) for k, v in self.query_arguments.iteritems())
+        content_type = self._body_content_type()
+        if content_type.startswith("application/x-www-form-urlencoded") or \
+           content_type.startswith("multipart/form-data"):
+            for name, values in self.form_arguments.iteritems():
+                _arguments.setdefault(name, []).extend(values)
+        elif self.json_arguments:
+            _arguments = dict(_arguments, **self.json_arguments)
         return _arguments
 
     def write(self, content):
@@ -270,24 +843,45 @@ class ServicePublisher(object):
         self._debug = debug
         if self._debug:
             _log.setLevel(logging.DEBUG)
-        self._endpoints = []
-        if endpoints:
-            assert isinstance(endpoints, list), "endpoints must be a list"
-            for ep in endpoints:
-                self.add_endpoint(ep)
-        # TODO Fix fallback app here and below
-        self._fallbackapp = fallbackapp
-
         if not default_error_handler:
             default_error_handler = JsonErrorHandler()
         self._options = Dictomatic({
             "default_error_handler": default_error_handler,
+            "route_cache_size": 0,
+            # None, 'warn' or 'strict' (refuse endpoints that fail). What
+            # the check found is kept as each endpoint's redos_report.
+            "redos_check": "warn",
+            "redos_benchmark": False,
+            # request body limits, see WSGIRequest.body_stream. Endpoints
+            # can override max_body_size.
+            "max_body_size": None,
+            "body_spool_size": DEFAULT_BODY_SPOOL_SIZE,
+            "body_timeout": None,
+            # None allows any ratio of inflated to compressed body size
+            "max_compression_ratio": DEFAULT_MAX_COMPRESSION_RATIO,
+            # query string limits, see parse_query_string
+            "max_query_params": DEFAULT_MAX_QUERY_PARAMS,
+            "max_query_key_length": DEFAULT_MAX_QUERY_KEY_LENGTH,
+            # None keeps the json backend as it is, otherwise a name from
+            # nudge.json.BACKENDS or 'auto'. The backend is process wide.
+            "json_backend": None,
         })
 
         if options:
             assert isinstance(options, dict), "options must be of type dict"
             self._options.update(options)
         self.verify_options()
+        if self._options.json_backend:
+            nudge.json.use_backend(self._options.json_backend)
+
+        self._endpoints = []
+        self._router = Router(cache_size=self._options.route_cache_size)
+        if endpoints:
+            assert isinstance(endpoints, list), "endpoints must be a list"
+            for ep in endpoints:
+                self.add_endpoint(ep)
+        # TODO Fix fallback app here and below
+        self._fallbackapp = fallbackapp
 
     def verify_options(self):
         msg = "Default exception handler "
@@ -310,6 +904,28 @@ class ServicePublisher(object):
             assert isinstance(v, str),\
                 msg + "headers keys and values must be a byte string"
 
+        assert isinstance(self._options.route_cache_size, int) and \
+            self._options.route_cache_size >= 0,\
+            "route_cache_size must be an int >= 0"
+        assert self._options.redos_check in (None, False, 'warn', 'strict'),\
+            "redos_check must be None, 'warn' or 'strict'"
+        for name in ("max_body_size", "body_timeout",
+                     "max_compression_ratio"):
+            value = self._options[name]
+            assert value is None or \
+                (isinstance(value, (int, float)) and value >= 0), \
+                name + " must be None or a number >= 0"
+        for name in ("max_query_params", "max_query_key_length"):
+            value = self._options[name]
+            assert value is None or (isinstance(value, int) and value > 0), \
+                name + " must be None or an int > 0"
+        assert isinstance(self._options.body_spool_size, int) and \
+            self._options.body_spool_size >= 0, \
+            "body_spool_size must be an int >= 0"
+        assert self._options.json_backend in \
+            (None, 'auto') + nudge.json.BACKENDS, \
+            "json_backend must be None, 'auto' or one of nudge.json.BACKENDS"
+
         # Set default error params here incase of massive failure we fallback
         # to these.
         self._options.default_error_response = (
@@ -319,13 +935,59 @@ class ServicePublisher(object):
             self._options.default_error_handler.headers,
         )
 
+    @property
+    def route_cache(self):
+        """ The RouteCache (with its hits and misses counters) if the
+            route_cache_size option is set, otherwise None """
+        return self._router.cache
+
     def add_endpoint(self, endpoint):
         assert isinstance(endpoint, Endpoint)
+        if self._options.redos_check:
+            # (pattern, problems, worst case seconds or None) for each uri
+            endpoint.redos_report = check_endpoint(
+                endpoint,
+                strict=self._options.redos_check == 'strict',
+                benchmark=self._options.redos_benchmark,
+            )
         self._endpoints.append(endpoint)
+        self._router.add(endpoint)
 
     def _add_args(self, req):
         args = req.QUERY_STRING.split('=')
 
+    def _limit_body(self, req, endpoint):
+        """ Applies the body limits for endpoint to req and answers a 413
+            right away if the declared Content-Length is over them """
+        if not isinstance(req, WSGIRequest):
+            return
+        max_body_size = endpoint.max_body_size
+        if max_body_size is None:
+            max_body_size = self._options.max_body_size
+        req.max_body_size = max_body_size
+        req.body_spool_size = self._options.body_spool_size
+        req.body_timeout = self._options.body_timeout
+        req.max_compression_ratio = self._options.max_compression_ratio
+        req.check_content_length()
+
+    def _invoke(self, req, endpoint, path_args):
+        """ Binds the request to endpoint's args, calls it and renders the
+            result. Returns (content, content_type, code, headers). """
+        args, kwargs = endpoint.bind(
+            req, ArgumentView(req, path_args, body=endpoint.body_args))
+
+        # invoke the service endpoint
+        result = endpoint(*args, **kwargs)
+
+        # TODO make sure this works with unicode
+        _log.debug(_gen_trace_str(endpoint.function, args, kwargs, result))
+
+        if isinstance(endpoint.renderer, RequestAwareRenderer):
+            r = endpoint.renderer(req, result)
+        else:
+            r = endpoint.renderer(result)
+        return r.content, r.content_type, r.http_status, r.headers
+
     def __call__(self, environ, start_response):
         """
             This is called by each request to the server.
@@ -335,6 +997,9 @@ class ServicePublisher(object):
             req = WSGIRequest(environ)
         else:
             req = environ
+        if isinstance(req, WSGIRequest):
+            req.max_query_params = self._options.max_query_params
+            req.max_query_key_length = self._options.max_query_key_length
 
         # main exception handler to ensure client gets valid response.
         # defer any mutation of the request object (incl. writes to the client)
@@ -344,65 +1009,48 @@ class ServicePublisher(object):
         final_content = ""
         endpoint = None
         try:
-            # allow '_method' query arg to overide method
+            # allow the '_method' query arg or the X-HTTP-Method-Override
+            # header to overide method. Routing happens before the body is
+            # read, so a '_method' in the body is not honored.
             method = req.method
-            if '_method' in req.arguments:
-                method = req.arguments['_method'][0].upper()
-                del req.arguments['_method']
+            if isinstance(req, WSGIRequest):
+                override = req.query_arguments.pop('_method', None) or \
+                    req.headers.lookup('x_http_method_override')
+            else:
+                override = req.arguments.pop('_method', None)
+            if override:
+                if isinstance(override, list):
+                    override = override[0]
+                method = str(override).upper()
 
             # find appropriate endpoint
-            reqline = method + urllib.unquote(req.path)
-            match = None
-            for endpoint in self._endpoints:
-                match = endpoint.match(reqline)
-                if match:
-                    break
-
-            if not match:
-                # TODO: Handle HTTPException in new world exceptions
-                raise HTTPException(404)
-                #
-                # Fallback app is untested with WSGI/EVENTLET
-                # FIXTHIS!!
-                #
-                # if self._fallbackapp:
-                    # _log.debug("falling through: %s %s" % (method, req.uri))
-                    # return self._fallbackapp(event_req, start_response)
-                # else:
-                    # raise HTTPException(404)
-
-            # convert all values in req.arguments from lists to scalars,
-            # then combine with path args.
-            arguments = dict((k, v[0]) for k, v in req.arguments.iteritems()\
-                if isinstance(v, list) and len(v) > 0)
-            inargs = dict(match.groupdict(), **arguments)
-
-            # compile positional arguments
-            args = []
-            for arg in endpoint.sequential:
-                args.append(arg.argspec(req, inargs))
-
-            # compile keyword arguments
-            kwargs = {}
-            for argname, arg in endpoint.named.iteritems():
-                r = arg.argspec(req, inargs)
-                if r != None:
-                    kwargs[argname] = r
-
-            # invoke the service endpoint
-            result = endpoint(*args, **kwargs)
-
-            # TODO make sure this works with unicode
-            _log.debug(_gen_trace_str(endpoint.function, args, kwargs, result))
-
-            if isinstance(endpoint.renderer, RequestAwareRenderer):
-                r = endpoint.renderer(req, result)
+            path = urllib.unquote(req.path)
+            endpoint, path_args = self._router.resolve(method, path)
+
+            if endpoint is not None:
+                self._limit_body(req, endpoint)
+                content, content_type, code, extra_headers = \
+                    self._invoke(req, endpoint, path_args)
             else:
-                r = endpoint.renderer(result)
-            content, content_type, code, extra_headers = \
-                r.content, r.content_type, r.http_status, r.headers
+                allowed = self._router.allowed_methods(path)
+                if not allowed:
+                    # TODO: Handle HTTPException in new world exceptions
+                    raise HTTPException(404)
+                    #
+                    # Fallback app is untested with WSGI/EVENTLET
+                    # FIXTHIS!!
+                    #
+                    # if self._fallbackapp:
+                        # _log.debug("falling through: %s %s" % (method, req.uri))
+                        # return self._fallbackapp(event_req, start_response)
+                    # else:
+                        # raise HTTPException(404)
+
+                # the path exists under other methods
+                raise HTTPException(405, headers={'Allow': ', '.join(allowed)})
 
         except (Exception), e:
+            exception = e
             error_response = None
             logged_trace = False
             #
@@ -436,6 +1084,8 @@ class ServicePublisher(object):
 
             code, content_type, content, extra_headers = \
                 error_response or self._options.default_error_response
+            if isinstance(exception, HTTPException) and exception.headers:
+                extra_headers = dict(extra_headers or {}, **exception.headers)
 
         final_content = _finish_request(
             req,
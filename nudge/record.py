@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Typed records for JSON bodies, declared with the args endpoints use.
+
+    User = record('User', [
+        args.String('name'),
+        args.Integer('age', min_=0, optional=True, default=0),
+        args.Arg('address', validator=Address.from_json, optional=True),
+    ])
+    user = User.from_json({"name": "bob"})
+
+record() generates a class with a slot per field and a from_json() compiled
+for its fields, which validates a decoded JSON object straight into a new
+instance. Unknown keys are ignored. Unlike query string args, only a field
+that is missing or null counts as missing, so false, 0 and empty strings
+are left to the validator. Records encode back to JSON as the dict of
+their fields that are not None.
+"""
+
+import re
+
+import nudge.arg
+import nudge.validator as validate
+from nudge.json import JsonSerializable
+from nudge.utils import FunctionBuilder
+
+__all__ = [
+    'Record',
+    'record',
+]
+
+_identifier = re.compile(r'[A-Za-z_]\w*$')
+
+
+class Record(JsonSerializable):
+    """ Base of the classes record() generates """
+
+    __slots__ = ()
+    # the field names, in declaration order
+    _fields = ()
+
+    def __init__(self, **fields):
+        """ A record of the given fields, with None for the others. Nothing
+            is validated, from_json() is what does that. """
+        for name in self._fields:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError("unknown fields for %s: %s" % (
+                type(self).__name__, ', '.join(sorted(fields))))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, n) == getattr(other, n) for n in self._fields)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (n, getattr(self, n)) for n in self._fields))
+
+# names a field cannot have, as its slot would hide them
+_RESERVED = frozenset(dir(Record) + ['from_json'])
+
+_FIELD = """\
+value = data.get(%(name)s)
+if value is None:
+    %(missing)s
+else:
+    try:
+        value = %(validator)s(value)
+    except ValidationError, e:
+        raise _invalid(%(name)s, value, e)
+record.%(field)s = value
+"""
+
+def _invalid(name, data, e):
+    msg = "invalid value for '%s': '%s'" % (name, data)
+    if e.message:
+        msg += ': %s' % e.message
+    return validate.ValidationError(msg)
+
+def _missing(name):
+    return validate.ValidationError(name + " is required but does not exist")
+
+def record(name, fields):
+    """ Generates a Record class called name with the fields, a list of
+        nudge.arg.Arg, each giving the key, validator, whether it is
+        optional and its default. Validators may be the from_json of other
+        records to nest them. """
+    names = []
+    f = FunctionBuilder('from_json', ['cls', 'data'], {
+        'ValidationError': validate.ValidationError,
+        '_invalid': _invalid,
+        '_missing': _missing,
+    })
+    f.add('if not isinstance(data, dict):')
+    f.add('raise ValidationError("must be of type dict")', 2)
+    f.add('record = cls.__new__(cls)')
+    for field in fields:
+        assert isinstance(field, nudge.arg.Arg) and \
+            not isinstance(field, nudge.arg.CustomArg), \
+            "record fields must be standard nudge.arg args"
+        assert field.validator, \
+            "Arg has no validator for property: '%s'" % field.name
+        assert _identifier.match(field.name) and \
+            not field.name.startswith('__'), \
+            "record field names must be identifiers: '%s'" % field.name
+        assert field.name not in _RESERVED, \
+            "record field name '%s' is reserved" % field.name
+        assert field.name not in names, \
+            "field '%s' appears twice in record %s" % (field.name, name)
+        names.append(field.name)
+        keys = {
+            'name': f.const(field.name),
+            'validator': f.const(field.validator),
+            'field': field.name,
+        }
+        if field.optional:
+            keys['missing'] = 'value = %s' % f.const(field.default)
+        else:
+            keys['missing'] = 'raise _missing(%(name)s)' % keys
+        f.add(_FIELD % keys)
+    f.add('return record')
+    from_json = f.compile()
+    from_json.__doc__ = """ Validates a decoded JSON object into a new %s,
+        raising a ValidationError naming the field that failed """ % name
+
+    return type(name, (Record,), {
+        '__slots__': tuple(names),
+        '_fields': tuple(names),
+        'from_json': classmethod(from_json),
+    })
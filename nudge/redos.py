@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Startup checks for endpoint patterns that can backtrack catastrophically.
+
+Endpoint regexes are matched against attacker controlled paths, so a single
+pattern such as '/(\w+\s?)+$' can pin a worker. analyze() looks for the two
+usual culprits in the parsed pattern:
+
+* nested quantifiers, where an unbounded repeat sits inside another one and
+  both can consume the same characters ('(a+)+', '(\w+\s?)*')
+* overlapping alternations inside an unbounded repeat ('(a|ab)+',
+  '(\w|\d)*')
+
+worst_case() complements that by timing the compiled regex against
+generated paths built to make it backtrack.
+"""
+
+import logging
+import sre_constants as sre
+import sre_parse
+import string
+import time
+
+from nudge.error import SecurityException
+from nudge.router import _literal_prefix
+
+_log = logging.getLogger("nudge.redos")
+
+__all__ = [
+    'analyze',
+    'worst_case',
+    'check_endpoint',
+]
+
+# Character sets are approximated over printable ascii, which is what
+# matters for paths.
+_ALL = frozenset(string.printable)
+_CATEGORIES = {
+    sre.CATEGORY_DIGIT: frozenset(string.digits),
+    sre.CATEGORY_WORD: frozenset(string.ascii_letters + string.digits + '_'),
+    sre.CATEGORY_SPACE: frozenset(string.whitespace),
+}
+_CATEGORIES[sre.CATEGORY_NOT_DIGIT] = _ALL - _CATEGORIES[sre.CATEGORY_DIGIT]
+_CATEGORIES[sre.CATEGORY_NOT_WORD] = _ALL - _CATEGORIES[sre.CATEGORY_WORD]
+_CATEGORIES[sre.CATEGORY_NOT_SPACE] = _ALL - _CATEGORIES[sre.CATEGORY_SPACE]
+
+_REPEATS = (sre.MAX_REPEAT, sre.MIN_REPEAT)
+_ZERO_WIDTH = (sre.AT, sre.ASSERT, sre.ASSERT_NOT)
+
+def _char(code):
+    if code > 127:
+        return frozenset()
+    return frozenset([chr(code)]) & _ALL
+
+def _in_set(items):
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op == sre.NEGATE:
+            negate = True
+        elif op == sre.LITERAL:
+            chars |= _char(av)
+        elif op == sre.RANGE:
+            chars |= set(chr(c) for c in range(av[0], min(av[1], 127) + 1))
+        elif op == sre.CATEGORY:
+            chars |= _CATEGORIES.get(av, _ALL)
+    chars &= _ALL
+    return frozenset(_ALL - chars if negate else chars)
+
+def _subpattern(av):
+    # (group, pattern) on older versions, (group, flags, flags, pattern) now
+    return av[-1]
+
+def _nullable(seq):
+    """ Whether the sequence of parsed items can match the empty string """
+    for op, av in seq:
+        if op in _ZERO_WIDTH:
+            continue
+        if op in _REPEATS:
+            if av[0] > 0 and not _nullable(av[2]):
+                return False
+        elif op == sre.SUBPATTERN:
+            if not _nullable(_subpattern(av)):
+                return False
+        elif op == sre.BRANCH:
+            if not any(_nullable(b) for b in av[1]):
+                return False
+        elif op == sre.GROUPREF:
+            continue
+        else:
+            return False
+    return True
+
+def _first(seq):
+    """ The set of characters a match of the sequence can start with """
+    chars = set()
+    for op, av in seq:
+        if op in _ZERO_WIDTH or op == sre.GROUPREF:
+            continue
+        if op == sre.LITERAL:
+            chars |= _char(av)
+        elif op == sre.NOT_LITERAL:
+            chars |= _ALL - _char(av)
+        elif op == sre.ANY:
+            chars |= _ALL - frozenset('\n')
+        elif op == sre.IN:
+            chars |= _in_set(av)
+        elif op in _REPEATS:
+            chars |= _first(av[2])
+            if av[0] > 0 and not _nullable(av[2]):
+                return chars
+            continue
+        elif op == sre.SUBPATTERN:
+            chars |= _first(_subpattern(av))
+            if not _nullable(_subpattern(av)):
+                return chars
+            continue
+        elif op == sre.BRANCH:
+            for branch in av[1]:
+                chars |= _first(branch)
+            if not any(_nullable(b) for b in av[1]):
+                return chars
+            continue
+        elif op == sre.GROUPREF_EXISTS:
+            chars |= _first(av[1])
+            if av[2]:
+                chars |= _first(av[2])
+            continue
+        return chars
+    return chars
+
+def _flatten(seq):
+    """ The items of seq with groups expanded in place """
+    items = []
+    for op, av in seq:
+        if op == sre.SUBPATTERN:
+            items.extend(_flatten(_subpattern(av)))
+        else:
+            items.append((op, av))
+    return items
+
+def _walk(seq, in_repeat, problems):
+    for op, av in seq:
+        if op in _REPEATS:
+            body = av[2]
+            unbounded = av[1] == sre.MAXREPEAT
+            if unbounded:
+                _check_nested(body, problems)
+            _walk(body, in_repeat or unbounded, problems)
+        elif op == sre.SUBPATTERN:
+            _walk(_subpattern(av), in_repeat, problems)
+        elif op == sre.BRANCH:
+            if in_repeat:
+                _check_overlap(av[1], problems)
+            for branch in av[1]:
+                _walk(branch, in_repeat, problems)
+        elif op in (sre.ASSERT, sre.ASSERT_NOT):
+            _walk(av[1], in_repeat, problems)
+        elif op == sre.GROUPREF_EXISTS:
+            _walk(av[1], in_repeat, problems)
+            if av[2]:
+                _walk(av[2], in_repeat, problems)
+
+def _check_nested(body, problems):
+    """ An unbounded repeat inside the body of another one is ambiguous if
+        whatever follows it in the body can be skipped and the outer loop can
+        start again with a character the inner repeat would also take. """
+    items = _flatten(body)
+    starts = _first(body)
+    for i, (op, av) in enumerate(items):
+        if op in _REPEATS and av[1] == sre.MAXREPEAT and \
+           _nullable(items[i+1:]) and _first(av[2]) & starts:
+            problems.append("nested quantifier")
+            return
+
+def _check_overlap(branches, problems):
+    seen = set()
+    for branch in branches:
+        chars = _first(branch)
+        if chars & seen or (_nullable(branch) and len(branches) > 1):
+            problems.append("overlapping alternation in a repeat")
+            return
+        seen |= chars
+
+def analyze(pattern):
+    """ Returns a list of descriptions of the constructs in pattern that can
+        backtrack catastrophically. An empty list means none were found. """
+    problems = []
+    _walk(sre_parse.parse(pattern), False, problems)
+    return problems
+
+def _repeat_chars(seq, chars):
+    for op, av in seq:
+        if op in _REPEATS:
+            if av[1] == sre.MAXREPEAT:
+                chars |= _first(av[2])
+            _repeat_chars(av[2], chars)
+        elif op == sre.SUBPATTERN:
+            _repeat_chars(_subpattern(av), chars)
+        elif op == sre.BRANCH:
+            for branch in av[1]:
+                _repeat_chars(branch, chars)
+    return chars
+
+def _adversarial_inputs(pattern, max_length):
+    """ Yields groups of inputs of growing length: the literal prefix of the
+        pattern followed by runs of the characters its unbounded repeats
+        accept, ended with a character that makes the match fail late. """
+    prefix = _literal_prefix(pattern)
+    chars = sorted(_repeat_chars(sre_parse.parse(pattern), set()))
+    # prefer a few plain characters over exotic ones
+    chars = ([c for c in chars if c.isalnum()] + \
+             [c for c in chars if not c.isalnum()])[:3]
+    length = 8
+    while chars and length <= max_length:
+        yield [prefix + c * length + end for c in chars for end in '!\n']
+        length += 4
+
+def worst_case(regex, budget=0.05, max_length=40):
+    """ Times regex.match against generated adversarial inputs, stopping
+        as soon as one match takes longer than budget seconds. Returns the
+        (seconds, input) of the slowest match seen. """
+    worst = (0.0, '')
+    for inputs in _adversarial_inputs(regex.pattern, max_length):
+        for s in inputs:
+            start = time.time()
+            regex.match(s)
+            elapsed = time.time() - start
+            if elapsed > worst[0]:
+                worst = (elapsed, s)
+        if worst[0] > budget:
+            break
+    return worst
+
+def check_endpoint(endpoint, strict=False, benchmark=False, budget=0.05):
+    """ Analyzes every uri pattern of endpoint, logging a warning for each
+        problem found, or raising a SecurityException if strict. With
+        benchmark, also times each pattern against adversarial paths and
+        treats one slower than budget seconds the same way. Returns a list
+        of (pattern, problems, worst case seconds or None) tuples. """
+    results = []
+    for regex in endpoint.path_regexs:
+        problems = analyze(regex.pattern)
+        seconds = None
+        if benchmark:
+            seconds, s = worst_case(regex, budget)
+            if seconds > budget:
+                problems.append("took %.3fs to match %r" % (seconds, s))
+        if problems:
+            msg = "Endpoint %s uri pattern %r may backtrack " \
+                "catastrophically: %s" % (
+                    endpoint.name, regex.pattern, ', '.join(problems))
+            if strict:
+                raise SecurityException(msg)
+            _log.warning(msg)
+        results.append((regex.pattern, problems, seconds))
+    return results
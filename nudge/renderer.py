@@ -39,6 +39,8 @@ __all__ = [
 ]
 
 class Result(object):
+    __slots__ = ('content', 'content_type', 'http_status', 'headers')
+
     def __init__(self, content, content_type, http_status=200, headers=None):
         self.content = content
         self.content_type = content_type
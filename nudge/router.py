@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+__all__ = [
+    'Router',
+    'RouteCache',
+    'PathArgs',
+    'compile_template',
+    'register_converter',
+]
+
+# Older versions of sre refuse to compile patterns with 100 or more groups,
+# so combined patterns are built in chunks that stay under that limit.
+MAX_CHUNK_SIZE = 99
+
+_META = '.^$*+?{}[]()|\\'
+_QUANTIFIERS = '*+?{'
+_inline_flags = re.compile(r'\(\?[aiLmsux]')
+
+# name -> (regex for one value, conversion function or None)
+_converters = {
+    'str': (r'[^/]+', None),
+    'int': (r'\d+', int),
+    'float': (r'\d+(?:\.\d+)?', float),
+    'path': (r'.+', None),
+}
+_template_field = re.compile(r'\{([A-Za-z_]\w*)(?::(\w+))?\}')
+
+def register_converter(name, regex, convert=None):
+    """ Makes {field:name} available in uri templates. regex must match
+        exactly the text of one value (without capturing groups), and
+        convert, if given, turns that text into the value passed on as the
+        path argument. """
+    assert isinstance(name, str) and re.match(r'\w+$', name), \
+        "converter names must be identifiers"
+    assert re.compile(regex).groups == 0, \
+        "converter regexes must not have capturing groups"
+    assert convert is None or callable(convert), "convert must be callable"
+    _converters[name] = (regex, convert)
+
+def _escape(text):
+    return ''.join('\\' + c if c in _META else c for c in text)
+
+def compile_template(uri):
+    """ Compiles a uri template such as '/users/{id:int}/posts/{slug}' into
+        an anchored regex pattern with one named group per field, and a dict
+        of field name -> conversion function for the fields that need one.
+        Returns None if uri has no fields, ie. it is a plain regex uri. """
+    fields = list(_template_field.finditer(uri))
+    if not fields:
+        return None
+    pattern = []
+    converters = {}
+    names = set()
+    pos = 0
+    for field in fields:
+        name, kind = field.group(1), field.group(2) or 'str'
+        assert kind in _converters, \
+            "unknown converter '%s' in uri template %s" % (kind, uri)
+        assert not name in names, \
+            "field '%s' appears twice in uri template %s" % (name, uri)
+        names.add(name)
+        regex, convert = _converters[kind]
+        pattern.append(_escape(uri[pos:field.start()]))
+        pattern.append('(?P<%s>%s)' % (name, regex))
+        if convert:
+            converters[name] = convert
+        pos = field.end()
+    pattern.append(_escape(uri[pos:]))
+    pattern.append('$')
+    return ''.join(pattern), converters
+
+def _has_top_level_branch(pattern):
+    depth = 0
+    in_class = False
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+            if pattern[i+1:i+2] == '^':
+                i += 1
+            if pattern[i+1:i+2] == ']':
+                i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+def _literal_prefix(pattern):
+    """ Returns the literal text every string matched by pattern must start
+        with. Errs on the side of a shorter prefix: anything that is not
+        plainly literal ends it. """
+    return _scan_literal(pattern)[0]
+
+def _literal(pattern):
+    """ The path a route's pattern stands for when it is all literal text,
+        with or without a closing '$', else None """
+    if pattern.endswith('$') and not pattern.endswith('\\$'):
+        pattern = pattern[:-1]
+    prefix, end = _scan_literal(pattern)
+    if end == len(pattern):
+        return prefix
+    return None
+
+def _scan_literal(pattern):
+    """ (literal prefix of pattern, index in pattern where it ends) """
+    if _inline_flags.search(pattern) or _has_top_level_branch(pattern):
+        return '', 0
+    prefix = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            escaped = pattern[i+1:i+2]
+            if not escaped or escaped.isalnum():
+                break
+            prefix.append(escaped)
+            i += 2
+        elif c in _META:
+            break
+        else:
+            prefix.append(c)
+            i += 1
+    # a quantifier makes the preceding character optional or repeatable
+    if prefix and pattern[i:i+1] and pattern[i] in _QUANTIFIERS:
+        prefix.pop()
+        i = -1
+    return ''.join(prefix), i
+
+def _uncapture(pattern):
+    """ Rewrite every capturing group in pattern as a non-capturing one, so
+        the pattern can be embedded in a larger alternation. Returns None if
+        the pattern relies on its own groups (backreferences, conditionals)
+        or on inline flags, which would change meaning once combined. """
+    out = []
+    i, n = 0, len(pattern)
+    in_class = False
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            escaped = pattern[i+1:i+2]
+            if not in_class and escaped.isdigit() and escaped != '0':
+                # numbered backreference
+                return None
+            out.append(pattern[i:i+2])
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+            out.append(c)
+            i += 1
+            continue
+        if c == '[':
+            in_class = True
+            out.append(c)
+            i += 1
+            # a ']' straight after '[' or '[^' is a literal
+            if pattern[i:i+1] == '^':
+                out.append('^')
+                i += 1
+            if pattern[i:i+1] == ']':
+                out.append(']')
+                i += 1
+            continue
+        if c == '(':
+            if pattern.startswith('(?P<', i):
+                end = pattern.find('>', i)
+                if end < 0:
+                    return None
+                out.append('(?:')
+                i = end + 1
+            elif pattern.startswith('(?#', i):
+                end = pattern.find(')', i)
+                if end < 0:
+                    return None
+                i = end + 1
+            elif pattern.startswith('(?', i):
+                if not pattern[i+2:i+3] in (':', '=', '!') and \
+                   not pattern[i+2:i+4] in ('<=', '<!'):
+                    # named backreference, conditional or inline flags
+                    return None
+                out.append('(?')
+                i += 2
+            else:
+                out.append('(?:')
+                i += 1
+            continue
+        out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+def _combine(routes):
+    """ Builds the list of (combined regex, routes) chunks for routes, a
+        list of (index, endpoint, regex) tuples. A chunk without a combined
+        regex holds a single route that has to be matched on its own. """
+    chunks = []
+    pending = []
+    def flush():
+        if pending:
+            combined = re.compile('|'.join('(%s)' % p for p, _ in pending))
+            chunks.append((combined, [r for _, r in pending]))
+            del pending[:]
+    for route in routes:
+        pattern = _uncapture(route[2].pattern)
+        if pattern is not None:
+            try:
+                if re.compile(pattern).groups:
+                    pattern = None
+            except re.error:
+                pattern = None
+        if pattern is None:
+            flush()
+            chunks.append((None, [route]))
+            continue
+        pending.append((pattern, route))
+        if len(pending) == MAX_CHUNK_SIZE:
+            flush()
+    flush()
+    return chunks
+
+
+class _Node(object):
+    """ A radix trie node. edges maps the first character of an edge label
+        to (label, child); routes holds the routes whose literal prefix
+        ends exactly at this node, as (index, endpoint, regex, converters,
+        literal), literal being the one path the route matches if its
+        pattern is all literal text
+        tuples. """
+
+    def __init__(self):
+        self.edges = {}
+        self.routes = []
+        self.chunks = None
+
+    def first_match(self, path):
+        """ Returns the route with the lowest index filed at this node whose
+            regex matches path, or None """
+        chunks = self.chunks
+        if chunks is None:
+            chunks = self.chunks = _combine(self.routes)
+        for combined, routes in chunks:
+            if combined is None:
+                if routes[0][2].match(path):
+                    return routes[0]
+                continue
+            tag = combined.match(path)
+            if tag:
+                return routes[tag.lastindex - 1]
+        return None
+
+
+class PathArgs(dict):
+    """ The path args of a route resolved from a uri template. typed holds
+        the names of the args a converter produced, whose values are final
+        and are not validated again when they are bound. """
+
+    __slots__ = ('typed',)
+
+    def __init__(self, args, typed):
+        dict.__init__(self, args)
+        self.typed = typed
+
+
+class RouteCache(object):
+    """ Bounded LRU mapping of request lines to resolved routes. hits and
+        misses count lookups since the cache was created. """
+
+    def __init__(self, size):
+        assert isinstance(size, int) and size > 0, \
+            "route cache size must be a positive int"
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Router(object):
+    """ Resolves a request method and path to the first endpoint, in
+        registration order, for that method with a uri matching the path.
+
+        Endpoints are indexed by method, so a request never tries patterns
+        that belong to other methods. Under each method every uri pattern is
+        filed in a radix trie under its literal prefix (eg. '/api/v2/users/').
+        A lookup walks the trie along the path, so only the routes filed on
+        that walk are ever tried, and the cost grows with the length of the
+        path rather than with the number of endpoints.
+
+        Within a trie node the patterns are merged into as few alternations
+        as possible, each alternative wrapped in a single tagging group. One
+        match of the combined pattern tells us which route won; only the
+        overall winner's own regex is then run again to produce the match
+        object (and its groupdict). Patterns that cannot be merged safely
+        (backreferences, inline flags) are kept as standalone regexes in
+        their original position, so first-match-wins ordering is always
+        preserved. Combined patterns are built lazily on the first match
+        after a change.
+
+        If cache_size is given, resolve() keeps a RouteCache of that size
+        for routes whose pattern is all literal text, like '/status$', each
+        of which only ever matches that one path. Adding an endpoint clears
+        it. """
+
+    def __init__(self, cache_size=None):
+        self._methods = {}
+        self._count = 0
+        self.cache = RouteCache(cache_size) if cache_size else None
+
+    def add(self, endpoint):
+        root = self._methods.get(endpoint.method)
+        if root is None:
+            root = self._methods[endpoint.method] = _Node()
+        for regex, converters in zip(endpoint.path_regexs,
+                                     endpoint.path_converters):
+            node = _insert(root, _literal_prefix(regex.pattern))
+            node.routes.append((self._count, endpoint, regex, converters,
+                                _literal(regex.pattern)))
+            node.chunks = None
+            self._count += 1
+        if self.cache is not None:
+            self.cache.clear()
+
+    def __len__(self):
+        return self._count
+
+    def match(self, method, path):
+        """ Returns (endpoint, match) for the first route of method matching
+            path, or (None, None) if nothing matches """
+        root = self._methods.get(method)
+        if root is not None:
+            route = _lookup(root, path)
+            if route is not None:
+                return route[1], route[2].match(path)
+        return None, None
+
+    def resolve(self, method, path):
+        """ Returns (endpoint, path args) for the first route of method
+            matching path, or (None, None) if nothing matches. Path args
+            from uri template fields are already converted to their type,
+            and named in the typed attribute of the PathArgs returned.
+            The path args dict may be shared between requests and must not
+            be modified. """
+        cache = self.cache
+        if cache is not None:
+            resolved = cache.get(method + path)
+            if resolved is not None:
+                return resolved
+        root = self._methods.get(method)
+        route = _lookup(root, path) if root is not None else None
+        if route is None:
+            return None, None
+        index, endpoint, regex, converters, literal = route
+        match = regex.match(path)
+        path_args = match.groupdict()
+        if converters:
+            for name, convert in converters.iteritems():
+                path_args[name] = convert(path_args[name])
+            path_args = PathArgs(path_args, frozenset(converters))
+        elif cache is not None and path == literal:
+            # only a route of a single path, so a stream of paths matching
+            # a wildcard route cannot push the static ones out
+            cache.put(method + path, (endpoint, path_args))
+        return endpoint, path_args
+
+    def allowed_methods(self, path):
+        """ Returns the sorted list of methods with a route matching path """
+        return sorted(
+            method for method, root in self._methods.iteritems()
+            if _lookup(root, path) is not None
+        )
+
+
+def _insert(node, key):
+    """ Returns the node for key under node, creating it if needed """
+    while key:
+        edge = node.edges.get(key[0])
+        if edge is None:
+            child = _Node()
+            node.edges[key[0]] = (key, child)
+            return child
+        label, child = edge
+        common = len(os.path.commonprefix([label, key]))
+        if common < len(label):
+            # split the edge at the end of the shared part
+            middle = _Node()
+            middle.edges[label[common]] = (label[common:], child)
+            node.edges[key[0]] = (label[:common], middle)
+            child = middle
+        node = child
+        key = key[common:]
+    return node
+
+def _lookup(node, path):
+    """ Walks the trie under node along path and returns the matching
+        route with the lowest index, or None """
+    best = None
+    pos, end = 0, len(path)
+    while True:
+        if node.routes:
+            route = node.first_match(path)
+            if route is not None and (best is None or route[0] < best[0]):
+                best = route
+        if pos == end:
+            break
+        edge = node.edges.get(path[pos])
+        if edge is None or not path.startswith(edge[0], pos):
+            break
+        pos += len(edge[0])
+        node = edge[1]
+    return best
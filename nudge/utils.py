@@ -1,4 +1,5 @@
 import re
+import sys
 
 '''
     I'm a first class citizen dictionary.
@@ -67,3 +68,110 @@ def breakup_path(input, camel_case=True):
     if package:
         garbage, dot, package = package.rpartition('.')
     return package, class_name, function_name
+
+'''
+    Attributes computed on first read. On a plain class the value is
+    cached in the instance __dict__, which then shadows the descriptor.
+    On a LazySlots class it is cached in a slot of the same name. Either
+    way, later reads are plain attribute reads. An AttributeError raised
+    while computing the value comes out as a RuntimeError, as it would
+    otherwise read as the attribute itself being missing.
+'''
+class lazyprop(object):
+    def __init__(self, fn):
+        self.fn = fn
+        self.__name__ = fn.__name__
+        self.__doc__ = fn.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.compute(obj)
+        return value
+
+    def compute(self, obj):
+        try:
+            return self.fn(obj)
+        except AttributeError, e:
+            raise RuntimeError, \
+                "AttributeError computing %s: %s" % (self.__name__, e), \
+                sys.exc_info()[2]
+
+class _LazySlotsType(type):
+    def __new__(mcs, name, bases, ns):
+        # A slot and a class attribute cannot share a name, so the lazyprops
+        # move to the class's _lazyprops and their names become slots.
+        lazy = dict((k, v) for k, v in ns.items() if isinstance(v, lazyprop))
+        if lazy and '__slots__' in ns:
+            slots = ns['__slots__']
+            if isinstance(slots, str):
+                slots = (slots,)
+            for k in lazy:
+                del ns[k]
+            ns['__slots__'] = tuple(slots) + tuple(lazy)
+            inherited = {}
+            for base in reversed(bases):
+                inherited.update(getattr(base, '_lazyprops', {}))
+            inherited.update(lazy)
+            ns['_lazyprops'] = inherited
+        return type.__new__(mcs, name, bases, ns)
+
+class LazySlots(object):
+    __metaclass__ = _LazySlotsType
+    __slots__ = ()
+    # slot name -> lazyprop
+    _lazyprops = {}
+
+    def __getattr__(self, name):
+        # only reached for slots that are not set yet
+        prop = self._lazyprops.get(name)
+        if prop is None:
+            raise AttributeError(name)
+        value = prop.compute(self)
+        setattr(self, name, value)
+        return value
+
+'''
+    Source of one generated function. Values the code uses are put in the
+    function's globals with const(), which returns the name to use for
+    them, lines are added with add(), and compile() execs the source and
+    returns the function. nudge compiles arg binders, json serializers and
+    record constructors this way.
+'''
+class FunctionBuilder(object):
+    def __init__(self, name, params, namespace=None):
+        self.name = name
+        self.namespace = dict(namespace or {})
+        self.lines = ['def %s(%s):' % (name, ', '.join(params))]
+
+    def const(self, value):
+        name = '_c%d' % len(self.namespace)
+        self.namespace[name] = value
+        return name
+
+    def add(self, source, depth=1):
+        ''' Adds the lines of source to the body, depth levels in '''
+        pad = '    ' * depth
+        self.lines.extend(pad + line for line in source.splitlines())
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def compile(self):
+        exec self.source() in self.namespace
+        return self.namespace[self.name]
+
+def is_computed(obj, name):
+    ''' Whether the lazyprop name of obj has been computed '''
+    if name in getattr(obj, '__dict__', ()):
+        return True
+    if isinstance(obj, LazySlots):
+        if name not in obj._lazyprops:
+            return False
+        try:
+            # skips __getattr__, which would compute it
+            object.__getattribute__(obj, name)
+        except AttributeError:
+            return False
+        return True
+    return False
@@ -30,6 +30,12 @@ setup(
     ],
     namespace_packages = ['nudge'],
     install_requires=['simplejson>=2.1.3'],
+    # OrderedDict, SpooledTemporaryFile and with statements
+    python_requires='>=2.7, <3',
+    classifiers=[
+        'Programming Language :: Python :: 2 :: Only',
+        'Programming Language :: Python :: 2.7',
+    ],
     
     zip_safe=False,
 
@@ -26,7 +26,8 @@ from nose.tools import raises
 import nudge.arg as args
 import nudge.json as json
 import nudge.publisher as servicepublisher
-from nudge.publisher import WSGIRequest
+from nudge.publisher import WSGIRequest, ArgumentView
+from nudge.router import PathArgs
 import nudge.validator as vals
 
 # Unicode code point for the greek uppercase delta
@@ -434,6 +435,13 @@ class ArgTest(unittest.TestCase):
         req.body = ''
         self.assertEqual({"yay":12345}, args._get_json_body(req))
 
+    def test_json_body_decoded_once(self):
+        req = create_json_post_req({"body":'{"woot":"bar"}'})
+        self.assertEqual({"woot":"bar"}, args.JsonBody().argspec(req, None))
+        self.assertEqual("bar", args.JsonBodyField("woot").argspec(req, None))
+        self.assertTrue(req.json_arguments is req.json_body)
+        self.assertEqual({"woot":"bar"}, req.arguments)
+
     def test_get_no_json_body(self):
         req = create_req({"arguments":{}})
         body = args._get_json_body(req)
@@ -654,3 +662,157 @@ class ArgTest(unittest.TestCase):
         i = args.Dict("test")
         self.assertEqual([], i.argspec(req, None))
 
+
+class BinderTest(unittest.TestCase):
+
+    def test_no_args(self):
+        bind = args.compile_binder([], {})
+        self.assertEqual(((), {}), bind(None, None))
+
+    def test_bind(self):
+        req = create_json_post_req({
+            "QUERY_STRING": "name=bob",
+            "body": '{"tags":["x","y"],"name":"body"}',
+        })
+        bind = args.compile_binder(
+            [args.String('name'), args.Integer('id'), args.List('tags')],
+            {'ip': args.ClientIp(), 'missing': args.String('nope', optional=True),
+             'zero': args.Integer('zero', optional=True, default=5)},
+        )
+        self.assertEqual(
+            (['body', 0, ["x", "y"]], {'ip': '127.0.0.1', 'zero': 5}),
+            bind(req, ArgumentView(req, PathArgs({'id': 0, 'zero': ''}, ['id']))),
+        )
+
+    def test_bind_zero(self):
+        # only a converted path arg of 0 is present, like the baseline
+        # a json body 0 is empty
+        req = create_json_post_req({"body": '{"count":0}'})
+        spec = args.Integer('count', optional=True, default=5)
+        bind = args.compile_binder([spec], {})
+        self.assertEqual(([5], {}), bind(req, ArgumentView(req, {})))
+        self.assertEqual(5, spec.argspec(req, {}))
+        req = create_json_post_req({"body": '{}'})
+        view = ArgumentView(req, PathArgs({'count': 0}, ['count']))
+        self.assertEqual(([0], {}), bind(req, view))
+        self.assertEqual(0, spec.argspec(req, view))
+
+    def test_bind_validates_typed_path_args(self):
+        calls = []
+        def validator(value):
+            calls.append(value)
+            return value
+        req = create_json_post_req({"body": '{}'})
+        bind = args.compile_binder([args.Arg('id', validator=validator)], {})
+        self.assertEqual(([7], {}),
+            bind(req, ArgumentView(req, PathArgs({'id': 7}, ['id']))))
+        self.assertEqual([7], calls)
+        spec = args.Integer('id', min_=1, max_=10)
+        bind = args.compile_binder([spec], {})
+        for value in (0, 500):
+            view = ArgumentView(req, PathArgs({'id': value}, ['id']))
+            self.assertRaises(servicepublisher.HTTPException, bind, req, view)
+            self.assertRaises(servicepublisher.HTTPException,
+                spec.argspec, req, view)
+
+    def test_bind_matches_argspec(self):
+        req = create_json_post_req({"QUERY_STRING": "a=1&b=&c=x"})
+        specs = [args.Integer('a'), args.String('b'), args.Integer('c'),
+                 args.String('d'), args.String('b', optional=True)]
+        for spec in specs:
+            bind = args.compile_binder([spec], {})
+            try:
+                expected = spec.argspec(req, {})
+            except servicepublisher.HTTPException, e:
+                try:
+                    bind(req, ArgumentView(req, {}))
+                except servicepublisher.HTTPException, e2:
+                    self.assertEqual(e.message, e2.message)
+                else:
+                    self.fail("binder did not raise for %s" % spec.name)
+            else:
+                self.assertEqual(([expected], {}),
+                    bind(req, ArgumentView(req, {})))
+
+    def test_bind_validation_error_without_message(self):
+        # a bare ValidationError is a 400, it used to bind None
+        def validator(value):
+            raise vals.ValidationError()
+        req = create_json_post_req({"QUERY_STRING": "a=x"})
+        bind = args.compile_binder([args.Arg('a', validator=validator)], {})
+        try:
+            bind(req, ArgumentView(req, {}))
+        except servicepublisher.HTTPException, e:
+            self.assertEqual(400, e.status_code)
+            self.assertEqual("invalid value for argument 'a': 'x'", e.message)
+        else:
+            self.fail("binder did not raise")
+
+    def test_argument_view(self):
+        req = create_json_post_req({
+            "QUERY_STRING": "q=1&q=2&empty=&same=query&tags=y",
+            "body": '{"same":"body","tags":["x"],"q":"body"}',
+        })
+        # path, then json body, then query string
+        view = ArgumentView(req, {"id": "7", "same": "path"})
+        self.assertEqual("body", view.lookup("q"))
+        self.assertEqual("path", view["same"])
+        self.assertEqual(["x"], view["tags"])
+        self.assertEqual("7", view.get("id"))
+        self.assertEqual(u"", view["empty"])
+        self.assertTrue("id" in view)
+        self.assertFalse("nope" in view)
+        self.assertEqual("default", view.get("nope", "default"))
+        # without the body, query string args come after path args
+        view = ArgumentView(req, {"id": "7", "same": "path"}, body=False)
+        self.assertEqual([u"1", u"2"], view.lookup("q"))
+        self.assertEqual(u"1", view["q"])
+        self.assertEqual(u"path", view["same"])
+        self.assertEqual(u"y", view["tags"])
+
+    def test_argument_view_mapping(self):
+        # custom args written against the old inargs dict iterate over it
+        req = create_json_post_req({
+            "QUERY_STRING": "q=1&q=2&same=query",
+            "body": '{"same":"body","b":2}',
+        })
+        view = ArgumentView(req, {"id": "7", "same": "path"})
+        self.assertEqual(["id", "same", "b", "q"], view.keys())
+        self.assertEqual(view.keys(), list(view))
+        self.assertEqual(4, len(view))
+        self.assertEqual({"id": "7", "same": "path", "b": 2, "q": u"1"},
+            dict(view.items()))
+        self.assertEqual(dict(view.items()), dict(view.iteritems()))
+        self.assertEqual(["7", "path", 2, u"1"], view.values())
+
+    def test_argument_view_form(self):
+        req = create_req({
+            "QUERY_STRING": "a=query",
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": "application/x-www-form-urlencoded",
+            "body": "a=form&b=form",
+        })
+        view = ArgumentView(req, {"c": "path"})
+        self.assertEqual(u"query", view["a"])
+        self.assertEqual("form", view["b"])
+        self.assertEqual("path", view["c"])
+
+    def test_slots(self):
+        for arg in [args.String('a'), args.Integer('a'), args.List('a'),
+                    args.Action('a')]:
+            self.assertFalse(hasattr(arg, '__dict__'))
+        ep = servicepublisher.Endpoint(name='', method='GET', uri='/',
+            function=lambda a: a, args=([args.String('a')], {}))
+        self.assertFalse(hasattr(ep, '__dict__'))
+
+    @raises(AssertionError)
+    def test_two_body_streams_at_registration(self):
+        servicepublisher.Endpoint(name='', method='POST', uri='/',
+            function=lambda a, b: a,
+            args=([args.NdjsonBody(), args.JsonBodyItems('items.*')], {}))
+
+    @raises(AssertionError)
+    def test_missing_validator_at_registration(self):
+        def handler(a): pass
+        servicepublisher.Endpoint(name='', method='GET', uri='/', 
+            function=handler, args=([args.Arg('a')], {}))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import gzip
+import unittest
+import zlib
+
+import cStringIO as StringIO
+
+from nudge.compression import Inflater
+from nudge.error import HTTPException
+
+DATA = '{"items": [%s]}' % ', '.join(str(i) for i in range(5000))
+
+def gzipped(data):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+def raw_deflated(data):
+    c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+def inflate(encoding, body, chunk_size=100, **kwargs):
+    out = []
+    inflater = Inflater(encoding, out.append, chunk_size=1024, **kwargs)
+    for i in range(0, len(body), chunk_size):
+        inflater.feed(body[i:i + chunk_size])
+    inflater.close()
+    return ''.join(out)
+
+def status(f, *args, **kwargs):
+    try:
+        f(*args, **kwargs)
+    except HTTPException, e:
+        return e.status_code
+
+
+class InflaterTest(unittest.TestCase):
+
+    def test_encodings(self):
+        self.assertEqual(DATA, inflate('gzip', gzipped(DATA)))
+        self.assertEqual(DATA, inflate('x-gzip', gzipped(DATA), 7))
+        self.assertEqual(DATA, inflate('deflate', zlib.compress(DATA)))
+        self.assertEqual(DATA, inflate('deflate', raw_deflated(DATA), 3))
+        self.assertEqual('', inflate('gzip', ''))
+
+    def test_deflate_one_byte_chunks(self):
+        body = DATA[:500]
+        self.assertEqual(body, inflate('deflate', raw_deflated(body), 1))
+        self.assertEqual(body, inflate('deflate', zlib.compress(body), 1))
+        self.assertEqual('', inflate('deflate', ''))
+        self.assertEqual(400, status(inflate, 'deflate', 'x'))
+
+    def test_unsupported(self):
+        self.assertEqual(415, status(Inflater, 'br', None))
+
+    def test_invalid(self):
+        self.assertEqual(400, status(inflate, 'gzip', 'not gzip at all'))
+        self.assertEqual(400, status(inflate, 'gzip', gzipped(DATA)[:-20]))
+
+    def test_size_limit(self):
+        self.assertEqual(DATA, inflate('gzip', gzipped(DATA),
+            max_size=len(DATA)))
+        self.assertEqual(413, status(inflate, 'gzip', gzipped(DATA),
+            max_size=len(DATA) - 1))
+
+    def test_bomb(self):
+        bomb = gzipped('\0' * (10 * 1024 * 1024))
+        out = []
+        inflater = Inflater('gzip', out.append, max_ratio=100,
+            chunk_size=1024)
+        self.assertEqual(413, status(inflater.feed, bomb))
+        # it stopped well before inflating the whole thing
+        self.assertTrue(inflater.size_out <= 100 * len(bomb) + 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,7 +17,9 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
 import datetime
+import decimal
 import unittest
+import uuid
 
 from nose.tools import raises
 
@@ -138,3 +140,212 @@ class JsonTest(unittest.TestCase):
         result = json.Dictomatic.wrap(data)
         self.assertEqual(None, result['bad_thing'])
 
+    def test_aliases(self):
+        data = '{"testThis": 2, "test_that": 3, "nested": {"innerKey": [1]}}'
+        result = json.Dictomatic.wrap(data, aliases=True)
+        self.assertEqual({"test_this": "testThis", "testThat": "test_that"},
+            result._aliases)
+        self.assertEqual(2, result.test_this)
+        self.assertEqual(3, result.testThat)
+        self.assertEqual([1], result.nested.inner_key)
+        # keys set later are still found by translation
+        result.newKey = 4
+        self.assertEqual(4, result.new_key)
+        self.assertEqual(None, result.missing_key)
+
+    def test_lazy(self):
+        data = '{"outerKey": {"innerKey": {"deep": 1}}, "items": [{"a": 1}]}'
+        result = json.Dictomatic.wrap(data, lazy=True)
+        self.assertEqual(json.json_decode(data), result)
+        # values() does not wrap
+        assert dict in [type(v) for v in result.values()]
+        # nothing below the top level is wrapped until it is looked up
+        self.assertEqual(dict, type(dict.__getitem__(result, 'outerKey')))
+        inner = result.outer_key.innerKey
+        assert isinstance(inner, json.Dictomatic)
+        self.assertEqual(1, inner.deep)
+        assert result['outerKey'] is result.outerKey
+        assert isinstance(result.get('outerKey'), json.Dictomatic)
+        self.assertEqual(None, result.get('missing'))
+        self.assertEqual([{"a": 1}], result["items"])
+
+    def test_lazy_aliases(self):
+        result = json.Dictomatic.wrap(
+            {"outerKey": {"innerKey": 1}}, aliases=True, lazy=True)
+        self.assertEqual(1, result.outer_key.inner_key)
+        self.assertEqual({"inner_key": "innerKey"}, result.outer_key._aliases)
+
+    def test_lazy_list(self):
+        results = json.Dictomatic.wrap('[{"a": {"b": 1}}]', lazy=True)
+        self.assertEqual(1, results[0].a.b)
+
+    def test_translations_cached(self):
+        json._translations.clear()
+        result = json.Dictomatic.wrap({"testThis": 1})
+        self.assertEqual(1, result.test_this)
+        self.assertEqual(('testThis', 'test_this'),
+            json._translations['test_this'])
+        json._translations['test_this'] = ('testThis', 'test_this')
+        self.assertEqual(1, result.test_this)
+
+    def test_translation_cache_bounded(self):
+        json._translations.clear()
+        result = json.Dictomatic()
+        for i in range(json.TRANSLATION_CACHE_SIZE + 10):
+            getattr(result, 'name_%d' % i)
+        assert len(json._translations) <= json.TRANSLATION_CACHE_SIZE
+
+
+class SerializerTest(unittest.TestCase):
+
+    def tearDown(self):
+        json._serializers.pop(Point, None)
+        json._serializers.pop(Labeled, None)
+        json._resolved.clear()
+
+    def test_builtin_serializers(self):
+        self.assertEqual('["2011-01-02", "03:04:05", 1.5, '
+            '"12345678-1234-5678-1234-567812345678", [1]]', json.json_encode([
+                datetime.date(2011, 1, 2), datetime.time(3, 4, 5),
+                decimal.Decimal('1.5'),
+                uuid.UUID('12345678123456781234567812345678'), set([1])]))
+
+    def test_decimal_keeps_precision(self):
+        value = decimal.Decimal('0.10000000000000000000001')
+        # simplejson writes it as an exact number
+        self.assertEqual('[0.10000000000000000000001]', json.json_encode([value]))
+        self.assertEqual('0.10000000000000000000001', json._default(value))
+
+    def test_register(self):
+        json.register_serializer(Point, lambda p: [p.x, p.y])
+        self.assertEqual('{"at": [1, 2]}', json.json_encode({"at": Point(1, 2)}))
+        # subclasses use it too
+        class Point3(Point): pass
+        self.assertEqual('[[3, 4]]', json.json_encode([Point3(3, 4)]))
+
+    def test_exact_type_wins_over_json_method(self):
+        self.assertEqual('{"label": "p"}', json.json_encode(Labeled(3, 4)))
+        json.register_serializer(Point, lambda p: [p.x, p.y])
+        self.assertEqual('{"label": "p"}', json.json_encode(Labeled(3, 4)))
+        json.register_serializer(Labeled, lambda p: 'labeled')
+        self.assertEqual('"labeled"', json.json_encode(Labeled(3, 4)))
+
+    def test_old_style_classes(self):
+        class Old:
+            def json(self):
+                return 1
+        class Other:
+            pass
+        self.assertEqual('1', json.json_encode(Old()))
+        self.assertRaises(TypeError, json.json_encode, Other())
+
+    def test_instance_json_attribute(self):
+        o = Point(1, 2)
+        o.json = lambda: "mine"
+        self.assertEqual('"mine"', json.json_encode(o))
+
+    @raises(AssertionError)
+    def test_register_not_a_class(self):
+        json.register_serializer(Point(1, 2), str)
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+class Labeled(Point):
+    def json(self):
+        return {"label": "p"}
+
+
+class BackendTest(unittest.TestCase):
+
+    def tearDown(self):
+        json.use_backend('simplejson')
+
+    def test_default_is_simplejson(self):
+        self.assertEqual('simplejson', json.get_backend())
+
+    def test_available(self):
+        available = json.available_backends()
+        assert 'simplejson' in available
+        assert 'json' in available
+        self.assertEqual(json.available_backends()[0], json.use_backend('auto'))
+
+    def test_backends_keep_semantics(self):
+        class Foo(json.JsonSerializable):
+            __dict__ = {"test": 1}
+        when = datetime.datetime(2011, 1, 2, 3, 4, 5)
+        data = {"foo": Foo(), "when": when, "list": [1, 2.5, None, False]}
+        expected = {"foo": {"test": 1}, "when": when.ctime(),
+            "list": [1, 2.5, None, False]}
+        for name in json.available_backends():
+            self.assertEqual(name, json.use_backend(name))
+            self.assertEqual(expected, json.json_decode(json.json_encode(data)))
+            self.assertEqual({"a": "x\ty"}, json.json_decode('{"a": "x\ty"}'))
+
+    def test_publisher_option(self):
+        from nudge.publisher import ServicePublisher
+        ServicePublisher(options={'json_backend': 'json'})
+        self.assertEqual('json', json.get_backend())
+
+    @raises(TypeError)
+    def test_backends_encode_fail(self):
+        json.use_backend('json')
+        json.json_encode(object())
+
+    def test_stdlib_backend(self):
+        import json as stdlib_json
+        try:
+            json.use_backend('json')
+            self.assertEqual(stdlib_json.JSONEncoder, type(json._encode.im_self))
+        finally:
+            json.use_backend('simplejson')
+
+    @raises(AssertionError)
+    def test_unknown_backend(self):
+        json.use_backend('yaml')
+
+
+class CompiledSerializerTest(unittest.TestCase):
+
+    def test_slots(self):
+        class Point(json.JsonSerializable):
+            __slots__ = ('x', 'y', '__hidden')
+        class Named(Point):
+            __slots__ = 'name'
+        p = Named()
+        p.x, p.y, p.name = 1, None, 'origin'
+        self.assertEqual({"x": 1, "name": "origin"}, p.json())
+        self.assertEqual('{"x": 1, "name": "origin"}', json.json_encode(p))
+
+    def test_slots_and_dict(self):
+        class Inner(json.JsonSerializable):
+            __slots__ = ('a',)
+            def __init__(self):
+                self.a = [1]
+        class Outer(Inner):
+            pass
+        o = Outer()
+        o.inner = Inner()
+        o.skipped = None
+        self.assertEqual({"a": [1], "inner": {"a": [1]}}, o.json())
+
+    def test_overridden_json_is_used_when_nested(self):
+        class Custom(json.JsonSerializable):
+            def json(self):
+                return "custom"
+        class Holder(json.JsonSerializable):
+            pass
+        h = Holder()
+        h.c = Custom()
+        self.assertEqual('{"c": "custom"}', json.json_encode(h))
+
+    def test_compiled_once_per_class(self):
+        class Foo(json.JsonSerializable):
+            pass
+        Foo().json()
+        serialize = json._class_serializers[Foo]
+        f = Foo()
+        f.a = 1
+        self.assertEqual({"a": 1}, f.json())
+        assert json._class_serializers[Foo] is serialize
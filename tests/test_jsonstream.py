@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import unittest
+
+from nose.tools import raises
+
+from nudge.json import json_decode
+from nudge.jsonstream import parse, items, path_prefix
+
+DOC = '{"name": "bulk\\u00e9", "items": [{"id": 1, "tags": ["a", "b"]}, ' \
+    '{"id": -2.5e3, "ok": true, "none": null, "empty": {}}, []], ' \
+    '"count": 3, "nested": {"items": [false]}}'
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_events(self):
+        self.assertEqual([
+            ('', 'start_map', None),
+            ('', 'map_key', 'a'),
+            ('a', 'start_array', None),
+            ('a.item', 'number', 1),
+            ('a.item', 'string', 'x'),
+            ('a.item', 'start_map', None),
+            ('a.item', 'end_map', None),
+            ('a', 'end_array', None),
+            ('', 'map_key', 'b'),
+            ('b', 'null', None),
+            ('', 'end_map', None),
+        ], list(parse(['{"a": [1, "x", {}], "b": null}'])))
+
+    def test_any_chunking(self):
+        expected = list(parse([DOC]))
+        for size in (1, 2, 3, 7, 64):
+            self.assertEqual(expected, list(parse(chunked(DOC, size))))
+
+    def test_scalar_document(self):
+        self.assertEqual([('', 'number', 12)], list(parse(['1', '2'])))
+        self.assertEqual([('', 'boolean', True)], list(parse(['tr', 'ue '])))
+
+    def test_strings_decode_like_json_decode(self):
+        s = '"tab\there \\"quoted\\" \\u2603"'
+        self.assertEqual(json_decode(s), list(parse(chunked(s, 3)))[0][2])
+
+    def test_escapes_split_across_chunks(self):
+        s = '["a\\\\\\"b\\\\", "' + 'x' * 1000 + '", 1]'
+        expected = json_decode(s)
+        for size in (1, 2, 3, 5, 64):
+            self.assertEqual(expected, list(items(parse(chunked(s, size)), '*')))
+
+    @raises(ValueError)
+    def test_unterminated_string(self):
+        list(parse(chunked('["abc', 2)))
+
+    @raises(ValueError)
+    def test_incomplete(self):
+        list(parse(['{"a": [1, 2']))
+
+    @raises(ValueError)
+    def test_invalid(self):
+        list(parse(['{"a" 1}']))
+
+    @raises(ValueError)
+    def test_trailing_comma(self):
+        list(parse(['[1, ]']))
+
+    @raises(ValueError)
+    def test_extra_data(self):
+        list(parse(['{} {}']))
+
+
+class ItemsTest(unittest.TestCase):
+
+    def test_path_prefix(self):
+        self.assertEqual('items.item', path_prefix('items.*'))
+        self.assertEqual('', path_prefix(''))
+
+    def test_items(self):
+        decoded = json_decode(DOC)
+        for size in (1, 5, len(DOC)):
+            self.assertEqual(decoded['items'],
+                list(items(parse(chunked(DOC, size)), 'items.*')))
+        self.assertEqual([3], list(items(parse([DOC]), 'count')))
+        self.assertEqual([decoded['nested']],
+            list(items(parse([DOC]), 'nested')))
+        self.assertEqual([[False]], list(items(parse([DOC]), 'nested.items')))
+        self.assertEqual([decoded], list(items(parse([DOC]), '')))
+        self.assertEqual([], list(items(parse([DOC]), 'missing.*')))
+
+    def test_items_are_lazy(self):
+        def chunks():
+            yield '[{"a": 1}, '
+            yield '{"a": 2}, '
+            raise AssertionError("read past the value asked for")
+        values = items(parse(chunks()), '*')
+        self.assertEqual({"a": 1}, values.next())
+
+
+class JsonDecodeTest(unittest.TestCase):
+
+    def test_tabs_kept_in_strings(self):
+        self.assertEqual({"a": "x\ty"}, json_decode('{\t"a":\t"x\ty"}'))
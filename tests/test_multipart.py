@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import unittest
+
+from nose.tools import raises
+
+from nudge.error import HTTPException
+from nudge.multipart import MultipartParser, get_boundary
+
+BOUNDARY = '----nudgeboundary'
+
+def multipart_body(parts, preamble='', epilogue=''):
+    lines = [preamble] if preamble else []
+    for headers, data in parts:
+        lines.append('--' + BOUNDARY)
+        lines.extend(headers)
+        lines.append('')
+        lines.append(data)
+    lines.append('--' + BOUNDARY + '--')
+    return '\r\n'.join(lines) + '\r\n' + epilogue
+
+BODY = multipart_body([
+    (['Content-Disposition: form-data; name="title"'], 'hello'),
+    (['Content-Disposition: form-data; name="tag"'], 'a'),
+    (['Content-Disposition: form-data; name="tag"'], ''),
+    (['Content-Disposition: form-data; name="upload"; filename="a.txt"',
+      'Content-Type: text/plain'], 'line one\r\n--not the boundary\r\n'),
+    (['Content-Disposition: form-data; name="blob"; filename="b.bin"'],
+     '\x00\xff' * 100),
+    ([], 'no name, ignored'),
+], preamble='ignored preamble', epilogue='ignored epilogue')
+
+def parse(body, chunk_size, **kwargs):
+    parser = MultipartParser(BOUNDARY, **kwargs)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    return parser.close()
+
+
+class MultipartTest(unittest.TestCase):
+
+    def test_boundary(self):
+        self.assertEqual(BOUNDARY, get_boundary(
+            'multipart/form-data; boundary=' + BOUNDARY))
+        self.assertEqual('a b', get_boundary(
+            'multipart/form-data; boundary="a b"'))
+        self.assertRaises(HTTPException, get_boundary, 'multipart/form-data')
+
+    def test_any_chunk_size(self):
+        for chunk_size in [1, 2, 3, 7, 19, 64, len(BODY)]:
+            fields, files = parse(BODY, chunk_size)
+            self.assertEqual({'title': ['hello'], 'tag': ['a', '']}, fields)
+            upload = files['upload'][0]
+            self.assertEqual('a.txt', upload['filename'])
+            self.assertEqual('text/plain', upload['content_type'])
+            self.assertEqual(
+                'line one\r\n--not the boundary\r\n', upload['body'].read())
+            blob = files['blob'][0]
+            self.assertEqual('application/octet-stream', blob['content_type'])
+            self.assertEqual('\x00\xff' * 100, blob['body'].read())
+
+    def test_files_spool_to_disk(self):
+        fields, files = parse(BODY, 64, spool_size=10)
+        self.assertTrue(files['blob'][0]['body']._rolled)
+        fields, files = parse(BODY, 64)
+        self.assertFalse(files['blob'][0]['body']._rolled)
+
+    @raises(HTTPException)
+    def test_incomplete(self):
+        parse(BODY[:len(BODY) // 2], 10)
+
+    def test_field_too_large(self):
+        try:
+            parse(BODY, 10, max_field_size=4)
+            self.fail()
+        except HTTPException, e:
+            self.assertEqual(413, e.status_code)
+
+    def test_abort_closes_files(self):
+        parser = MultipartParser(BOUNDARY)
+        parser.feed(BODY[:BODY.index('line one') + 4])
+        upload = parser._part['body']
+        parser.abort()
+        self.assertTrue(upload.closed)
+
+    @raises(HTTPException)
+    def test_too_many_parts(self):
+        parse(BODY, 10, max_parts=3)
+
+    @raises(HTTPException)
+    def test_headers_too_long(self):
+        parse(multipart_body([(['X-Long: ' + 'x' * 100], 'data')]), 10,
+              max_header_size=50)
+
+if __name__ == '__main__':
+    unittest.main()
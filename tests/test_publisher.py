@@ -32,6 +32,7 @@ from nudge.renderer import Json
 import httplib
 from nudge.publisher import ServicePublisher, Endpoint, Args, WSGIRequest
 from nudge.renderer import Result
+from nudge.error import JsonErrorHandler
 
 from nose.tools import raises
 
@@ -161,6 +162,21 @@ class HandlerTest(unittest.TestCase):
         resp.write(result)
         self.assertEqual(req._buffer,response_buf(200, '{"called": 1}'))
 
+    def test_route_cache(self):
+        def handler(): return dict(called=1)
+
+        sp = ServicePublisher(options={'route_cache_size': 8})
+        sp.add_endpoint(Endpoint(name='', method='GET', uri='/location', function=handler))
+        for i in range(2):
+            req = create_req('GET', '/location')
+            resp = MockResponse(req, 200)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer,response_buf(200, '{"called": 1}'))
+        self.assertEqual(1, sp.route_cache.hits)
+        self.assertEqual(1, sp.route_cache.misses)
+        self.assertEqual(None, ServicePublisher().route_cache)
+
     def test_multiuri_handler_noarg(self):
         def handler(): return dict(called=1)
 
@@ -204,6 +220,45 @@ class HandlerTest(unittest.TestCase):
         resp.write(result)
         self.assertEqual(req._buffer,response_buf(200, '{"name": "other_user"}'))
         
+    def test_typed_uri_template(self):
+        def handler(user, post): return dict(user=user, post=post)
+
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(
+            name='',
+            method='GET',
+            uri='/users/{user:int}/posts/{post}',
+            args=([args.Integer('user'), args.String('post')],{}),
+            function=handler
+        ))
+        req = create_req('GET', '/users/0/posts/first')
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(200, '{"post": "first", "user": 0}'))
+
+    def test_typed_uri_template_validated(self):
+        def handler(id): return dict(id=id)
+
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(
+            name='',
+            method='GET',
+            uri='/u/{id:int}',
+            args=([args.Integer('id', min_=1, max_=10)],{}),
+            function=handler
+        ))
+        for path, status in (('/u/0', 400), ('/u/500', 400), ('/u/5', 200)):
+            req = create_req('GET', path)
+            resp = MockResponse(req, 200)
+            sp(req, resp.start_response)
+            self.assertEqual(status, int(resp.status.split()[0]))
+
+    @raises(AssertionError)
+    def test_typed_uri_template_text_arg(self):
+        Endpoint(name='', method='GET', uri='/u/{name:int}',
+            args=([args.String('name')],{}), function=lambda name: name)
+
     def test_noargs_handlersuccess_empty(self):
         def handler(): return None
 
@@ -226,6 +281,51 @@ class HandlerTest(unittest.TestCase):
         resp.write(result)
         self.assertEqual(req._buffer,response_buf(404, '{"message": "Not Found", "code": 404}'))
 
+    def test_method_not_allowed(self):
+        def handler(): pass
+
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/location', function=handler))
+        sp.add_endpoint(Endpoint(name='', method='PUT', uri='/location', function=handler))
+        req = create_req('GET', '/location')
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(405,
+            '{"message": "Method Not Allowed", "code": 405}',
+            headers={'Allow': 'POST, PUT'}))
+
+    def test_method_not_allowed_custom_handler(self):
+        class Handler(JsonErrorHandler):
+            content_type = 'text/plain'
+            def __call__(self, e):
+                return e.status_code, self.content_type, 'custom', {}
+        def handler(): pass
+
+        sp = ServicePublisher(default_error_handler=Handler())
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/location', function=handler))
+        req = create_req('GET', '/location')
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        self.assertEqual('405 Method Not Allowed', resp.status)
+        self.assertEqual('POST', resp.headers['Allow'])
+        self.assertEqual(['custom\r\n'], result)
+
+    def test_uri_branch_keeps_method(self):
+        def handler(): return dict(arg1=1)
+
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='GET', uri='/a$|/b$', function=handler))
+        for method, path, code in [('GET', '/a', 200), ('GET', '/b', 200),
+                                   ('POST', '/b', 405)]:
+            req = create_req(method, path)
+            resp = MockResponse(req, code)
+            result = sp(req, resp.start_response)
+            self.assertEqual(code, int(resp.status.split()[0]))
+        ep = sp._endpoints[0]
+        assert ep.match('GET/b')
+        assert not ep.match('POST/b')
+
     def test_noargs_but_method_handlersuccess(self):
         def handler(): return dict(arg1=1)
 
@@ -238,6 +338,237 @@ class HandlerTest(unittest.TestCase):
         self.assertEqual(req._buffer,response_buf(200, '{"arg1": 1}'))
 
 
+    def test_method_override_header(self):
+        def handler(): return dict(arg1=1)
+
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='DELETE', uri='/location', function=handler))
+        req = create_req('POST', '/location')
+        req.headers['X-HTTP-Method-Override'] = 'delete'
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(200, '{"arg1": 1}'))
+
+    def test_body_not_read_for_unknown_route(self):
+        class Unreadable(object):
+            def read(self, *args):
+                raise AssertionError("body was read")
+        sp = ServicePublisher()
+        req = create_req('POST', '/nowhere', body='{"big": "body"}')
+        req.req._environ['wsgi.input'] = Unreadable()
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(404, '{"message": "Not Found", "code": 404}'))
+
+    def test_max_body_size(self):
+        def handler(name): return dict(name=name)
+        sp = ServicePublisher(options={'max_body_size': 10})
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/small',
+            args=([args.String('name')],{}), function=handler))
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/big',
+            args=([args.String('name')],{}), function=handler,
+            max_body_size=100))
+        body = '{"name": "%s"}' % ('x' * 20)
+        for uri, code, content in [
+                ('/small', 413, '{"message": "Request Entity Too Large", "code": 413}'),
+                ('/big', 200, '{"name": "%s"}' % ('x' * 20))]:
+            req = create_req('POST', uri, body=body)
+            req.req._environ['CONTENT_LENGTH'] = str(len(body))
+            resp = MockResponse(req, code)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer, response_buf(code, content))
+
+    def test_multipart_upload(self):
+        def handler(title, upload, stream):
+            return dict(upload='%s: %s (%s) %s' % (
+                title, upload['data'], upload['filename'],
+                stream['file'].read()))
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/upload',
+            args=([args.String('title'), args.UploadedFile('upload'),
+                   args.UploadedFile('upload', as_file=True)],{}),
+            function=handler))
+        body = '\r\n'.join([
+            '--xyz',
+            'Content-Disposition: form-data; name="title"',
+            '',
+            'hello',
+            '--xyz',
+            'Content-Disposition: form-data; name="upload"; filename="a.txt"',
+            'Content-Type: text/plain',
+            '',
+            'file data',
+            '--xyz--',
+            '',
+        ])
+        req = create_req('POST', '/upload', body=body)
+        req.req._environ['CONTENT_TYPE'] = 'multipart/form-data; boundary=xyz'
+        req.req._environ['CONTENT_LENGTH'] = str(len(body))
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer, response_buf(200,
+            '{"upload": "hello: file data (a.txt) file data"}'))
+        self.assertEqual(None, req._body)
+
+    def test_ndjson_body(self):
+        def handler(records):
+            return dict(total=sum(r['n'] for r in records))
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/import',
+            args=([args.NdjsonBody(validator=nudge.validator.Dict())],{}),
+            function=handler))
+        for body, code, content in [
+                ('{"n": 1}\n{"n": 2}\n{"n": 3}\n', 200, '{"total": 6}'),
+                ('{"n": 1}\n[]\n', 400, '{"message": "invalid value for '
+                    'argument \'record 2\': \'[]\': must be of type dict", '
+                    '"code": 400}')]:
+            req = create_req('POST', '/import', body=body)
+            req.req._environ['CONTENT_TYPE'] = 'application/x-ndjson'
+            resp = MockResponse(req, code)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer, response_buf(code, content))
+
+    def test_json_body_items(self):
+        def handler(records):
+            return dict(total=sum(r['n'] for r in records))
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/import',
+            args=([args.JsonBodyItems('records.*',
+                validator=nudge.validator.Dict())],{}),
+            function=handler))
+        for body, ctype, code, content in [
+                ('{"records": [{"n": 1}, {"n": 2}]}', 'application/json',
+                    200, '{"total": 3}'),
+                ('{"records": [{"n": 1}, 2]}', 'application/json', 400,
+                    '{"message": "invalid value for argument \'record 2\': '
+                    '\'2\': must be of type dict", "code": 400}'),
+                ('{"records": []}', 'text/plain', 415,
+                    '{"message": "body must be json", "code": 415}')]:
+            req = create_req('POST', '/import', body=body)
+            req.req._environ['CONTENT_TYPE'] = ctype
+            resp = MockResponse(req, code)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer, response_buf(code, content))
+
+    def test_json_body_items_query_arg(self):
+        # looking up source must not decode the whole body for args
+        def handler(records, source):
+            return dict(total=sum(r['n'] for r in records), source=source)
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/import',
+            args=Args(args.JsonBodyItems('records.*'), args.String('source')),
+            function=handler))
+        body = '{"source": "body", "records": [%s]}' % ', '.join(
+            ['{"n": 1}'] * 1000)
+        decoded = []
+        json_decode = json.json_decode
+        def counting_decode(data, *a, **kw):
+            decoded.append(len(data))
+            return json_decode(data, *a, **kw)
+        req = create_req('POST', '/import', body=body)
+        req.req._environ['CONTENT_TYPE'] = 'application/json'
+        req.req._environ['QUERY_STRING'] = 'source=query'
+        resp = MockResponse(req, 200)
+        json.json_decode = counting_decode
+        try:
+            result = sp(req, resp.start_response)
+        finally:
+            json.json_decode = json_decode
+        resp.write(result)
+        self.assertEqual(req._buffer,
+            response_buf(200, '{"source": "query", "total": 1000}'))
+        self.assertEqual([], [n for n in decoded if n >= len(body)])
+
+    def test_record_body(self):
+        from nudge.record import record
+        Item = record('Item', [args.String('sku'), args.Integer('count')])
+        def handler(items):
+            return dict(total=sum(i.count for i in items))
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/batch',
+            args=([args.RecordBody(Item, many=True)],{}), function=handler))
+        for body, code, content in [
+                ('[{"sku": "a", "count": 2}, {"sku": "b", "count": 3}]', 200,
+                    '{"total": 5}'),
+                ('[{"sku": "a", "count": 2}, {"sku": "b"}]', 400,
+                    '{"message": "invalid body: record 2: count is required '
+                    'but does not exist", "code": 400}'),
+                ('{"sku": "a"}', 400,
+                    '{"message": "invalid body: must be of type list", '
+                    '"code": 400}')]:
+            req = create_req('POST', '/batch', body=body)
+            req.req._environ['CONTENT_TYPE'] = 'application/json'
+            resp = MockResponse(req, code)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer, response_buf(code, content))
+
+    def test_body_not_decoded_for_path_args(self):
+        def handler(user): return dict(name=user)
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='POST', uri='/users/{user}',
+            args=([args.String('user')],{}), function=handler))
+        req = create_req('POST', '/users/bob', body='{not json')
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(200, '{"name": "bob"}'))
+
+    def test_path_args_beat_body_args(self):
+        # whatever the endpoint's other args are
+        def handler(user, note=None): return dict(name=user, note=note)
+        for endpoint_args, content in [
+                ([args.String('user'), args.String('note')],
+                    '{"note": "hi", "name": "bob"}'),
+                ([args.String('user')], '{"note": null, "name": "bob"}')]:
+            sp = ServicePublisher()
+            sp.add_endpoint(Endpoint(name='', method='POST',
+                uri='/users/{user}', args=(endpoint_args,{}),
+                function=handler))
+            req = create_req('POST', '/users/bob',
+                body='{"user":"al","note":"hi"}')
+            resp = MockResponse(req, 200)
+            result = sp(req, resp.start_response)
+            resp.write(result)
+            self.assertEqual(req._buffer, response_buf(200, content))
+
+    def test_request_not_wsgi(self):
+        # a request object of another server, with its args in one dict
+        class Request(object):
+            method = 'POST'
+            path = '/users/bob'
+            headers = {}
+            remote_ip = '127.0.0.1'
+            arguments = {'_method': ['put'], 'note': ['hi'], 'user': ['al']}
+        def handler(user, note): return dict(name=user, note=note)
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='PUT', uri='/users/{user}',
+            args=([args.String('user'), args.String('note')],{}),
+            function=handler))
+        resp = MockResponse(None, 200)
+        result = sp(Request(), resp.start_response)
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual(['{"note": "hi", "name": "bob"}\r\n'], result)
+
+    def test_method_override_not_an_arg(self):
+        def handler(_method): return dict(method=_method)
+        sp = ServicePublisher()
+        sp.add_endpoint(Endpoint(name='', method='DELETE', uri='/location',
+            args=([args.String('_method', optional=True)],{}),
+            function=handler))
+        req = create_req('POST', '/location')
+        req.req._environ['QUERY_STRING'] = '_method=delete'
+        resp = MockResponse(req, 200)
+        result = sp(req, resp.start_response)
+        resp.write(result)
+        self.assertEqual(req._buffer,response_buf(200, '{"method": null}'))
+
     def test_arg_handlersuccess(self):
         def handler(*args, **kwargs): return dict(arg1=1)
         sp = ServicePublisher()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import datetime
+import unittest
+
+from nose.tools import raises
+
+import nudge.arg as args
+import nudge.validator
+from nudge.json import json_encode
+from nudge.record import Record, record
+from nudge.validator import ValidationError
+
+Address = record('Address', [
+    args.String('city'),
+    args.String('zip', optional=True),
+])
+
+User = record('User', [
+    args.String('name'),
+    args.Integer('age', min_=0, optional=True, default=0),
+    args.Boolean('admin', optional=True),
+    args.Arg('address', validator=Address.from_json, optional=True),
+    args.Arg('born', validator=nudge.validator.Date(), optional=True),
+])
+
+
+class RecordTest(unittest.TestCase):
+
+    def failure(self, data):
+        try:
+            User.from_json(data)
+        except ValidationError, e:
+            return e.message
+        self.fail("%r validated" % (data,))
+
+    def test_from_json(self):
+        user = User.from_json({"name": "bob", "admin": False, "extra": 1,
+            "address": {"city": "LA"}, "born": "20100527"})
+        self.assertEqual(User(name="bob", age=0, admin=False,
+            address=Address(city="LA"), born=datetime.date(2010, 5, 27)),
+            user)
+        assert isinstance(user, Record)
+        assert not hasattr(user, '__dict__')
+        self.assertEqual(('name', 'age', 'admin', 'address', 'born'),
+            User._fields)
+
+    def test_errors(self):
+        self.assertEqual("must be of type dict", self.failure([]))
+        self.assertEqual("name is required but does not exist",
+            self.failure({"age": 1}))
+        self.assertEqual("name is required but does not exist",
+            self.failure({"name": None}))
+        self.assertEqual("invalid value for 'age': '-1': must be >= 0",
+            self.failure({"name": "bob", "age": -1}))
+        self.assertEqual("invalid value for 'address': '{}': city is "
+            "required but does not exist",
+            self.failure({"name": "bob", "address": {}}))
+
+    def test_json(self):
+        user = User.from_json({"name": "bob", "address": {"city": "LA"},
+            "born": "20100527"})
+        self.assertEqual({"name": "bob", "age": 0, "address": {"city": "LA"},
+            "born": datetime.date(2010, 5, 27)}, user.json())
+        assert '"born": "2010-05-27"' in json_encode(user)
+
+    def test_repr(self):
+        self.assertEqual("Address(city='LA', zip=None)",
+            repr(Address(city='LA')))
+
+    @raises(TypeError)
+    def test_unknown_init_field(self):
+        Address(town='LA')
+
+    @raises(AssertionError)
+    def test_custom_arg_field(self):
+        record('Bad', [args.JsonBody()])
+
+    @raises(AssertionError)
+    def test_duplicate_field(self):
+        record('Bad', [args.String('a'), args.String('a')])
+
+    def test_reserved_field_names(self):
+        for name in ('json', 'from_json', '_fields'):
+            self.assertRaises(AssertionError, record, 'Bad',
+                [args.String(name)])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import re
+import unittest
+
+from nose.tools import raises
+
+from nudge.error import SecurityException
+from nudge.publisher import Endpoint, ServicePublisher
+from nudge.redos import analyze, worst_case, check_endpoint
+
+def handler(): pass
+
+class AnalyzeTest(unittest.TestCase):
+
+    def test_nested_quantifiers(self):
+        for pattern in [r'/(a+)+$', r'/(\w+\s?)+$', r'/((\d+))*x']:
+            self.assertEqual(['nested quantifier'], analyze(pattern), pattern)
+
+    def test_overlapping_alternation(self):
+        for pattern in [r'/(a|ab)+$', r'/(\w|\d)*x', r'/(a|)+$']:
+            self.assertEqual(['overlapping alternation in a repeat'],
+                analyze(pattern), pattern)
+
+    def test_safe_patterns(self):
+        for pattern in [r'/users/(?P<id>[^/]+)$', r'/(?P<user>.*)/profile',
+                        r'/files(/[^/]+)*$', r'/(a+b)+$', r'/(a|b)+$',
+                        r'/(?P<x>\d+)-(?P<y>\d+)$', r'/$']:
+            self.assertEqual([], analyze(pattern), pattern)
+
+    def test_worst_case(self):
+        seconds, s = worst_case(re.compile(r'/(a+)+$'), budget=0.001)
+        self.assertTrue(seconds > 0.001)
+        self.assertTrue(s.startswith('/aaaa'))
+
+
+class CheckEndpointTest(unittest.TestCase):
+
+    def test_warn(self):
+        ep = Endpoint(name='bad', method='GET', uri=r'/(a+)+$', function=handler)
+        results = check_endpoint(ep)
+        self.assertEqual([(r'/(a+)+$', ['nested quantifier'], None)], results)
+
+    @raises(SecurityException)
+    def test_strict_publisher(self):
+        ServicePublisher(
+            endpoints=[Endpoint(name='bad', method='GET',
+                                uri=r'/(\w+\s?)+$', function=handler)],
+            options={'redos_check': 'strict'},
+        )
+
+    def test_strict_publisher_safe(self):
+        ep = Endpoint(name='ok', method='GET', uri=r'/users/(?P<id>[^/]+)$',
+                      function=handler)
+        sp = ServicePublisher(endpoints=[ep],
+            options={'redos_check': 'strict', 'redos_benchmark': True})
+        [(pattern, problems, seconds)] = ep.redos_report
+        self.assertEqual(r'/users/(?P<id>[^/]+)$', pattern)
+        self.assertEqual([], problems)
+        self.assertTrue(seconds < 0.05)
+
+    def test_warn_publisher_report(self):
+        ep = Endpoint(name='bad', method='GET', uri=r'/(a+)+$', function=handler)
+        self.assertEqual(None, ep.redos_report)
+        ServicePublisher(endpoints=[ep])
+        self.assertEqual([(r'/(a+)+$', ['nested quantifier'], None)],
+            ep.redos_report)
+
+if __name__ == '__main__':
+    unittest.main()
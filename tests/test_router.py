@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011 Evite LLC
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import unittest
+
+import nudge.router
+from nudge.publisher import Endpoint
+from nudge.router import Router, RouteCache, compile_template, \
+    register_converter, _uncapture, _literal_prefix, _literal
+
+def handler(): pass
+
+def ep(name, uri, method='GET'):
+    return Endpoint(name=name, method=method, uri=uri, function=handler)
+
+def linear_match(endpoints, method, path):
+    for endpoint in endpoints:
+        if endpoint.method != method:
+            continue
+        for regex in endpoint.path_regexs:
+            match = regex.match(path)
+            if match:
+                return endpoint, match
+    return None, None
+
+
+class UncaptureTest(unittest.TestCase):
+
+    def test_groups_become_noncapturing(self):
+        self.assertEqual(
+            '/(?:[^/]+)/(?:\d+)$', _uncapture('/(?P<user>[^/]+)/(\d+)$'))
+
+    def test_classes_and_escapes_untouched(self):
+        self.assertEqual('/[(]\(a\)', _uncapture('/[(]\(a\)'))
+        self.assertEqual('/[]()]', _uncapture('/[]()]'))
+
+    def test_lookarounds_kept(self):
+        self.assertEqual('/(?!x)(?<=/)a', _uncapture('/(?!x)(?<=/)a'))
+
+    def test_unmergeable(self):
+        for pattern in ['/(a)\\1', '/(?P<a>x)(?P=a)', '(?i)/a', '/(a)?(?(1)b)']:
+            self.assertEqual(None, _uncapture(pattern), pattern)
+
+
+class LiteralPrefixTest(unittest.TestCase):
+
+    def test_prefixes(self):
+        cases = [
+            ('/api/v2/users/(?P<id>[^/]+)$', '/api/v2/users/'),
+            ('/users/me$', '/users/me'),
+            ('/file\\.json', '/file.json'),
+            ('/items?/', '/item'),
+            ('/a{2}', '/'),
+            ('/\\d+', '/'),
+            ('/a|/b', ''),
+            ('(?i)/a', ''),
+            ('/(a|b)', '/'),
+        ]
+        for pattern, prefix in cases:
+            self.assertEqual(prefix, _literal_prefix(pattern), pattern)
+
+
+class TemplateTest(unittest.TestCase):
+
+    def test_regex_uri_is_not_a_template(self):
+        self.assertEqual(None, compile_template('/users/(?P<id>[^/]+)$'))
+        self.assertEqual(None, compile_template('/a{2}'))
+
+    def test_compile(self):
+        pattern, converters = compile_template('/users/{id:int}/posts/{slug}')
+        self.assertEqual(
+            '/users/(?P<id>\\d+)/posts/(?P<slug>[^/]+)$', pattern)
+        self.assertEqual({'id': int}, converters)
+        self.assertEqual('/api/v1.0/',
+            _literal_prefix(compile_template('/api/v1.0/{x}')[0]))
+
+    def test_resolve_converts(self):
+        router = Router()
+        router.add(ep('post', '/users/{id:int}/posts/{slug}'))
+        router.add(ep('file', '/files/{name:path}'))
+        endpoint, path_args = router.resolve('GET', '/users/0/posts/hello')
+        self.assertEqual({'id': 0, 'slug': 'hello'}, path_args)
+        self.assertEqual(frozenset(['id']), path_args.typed)
+        self.assertEqual((None, None), router.resolve('GET', '/users/x/posts/y'))
+        self.assertEqual((None, None), router.resolve('GET', '/users/1/posts/y/z'))
+        self.assertEqual({'name': 'a/b.txt'},
+            router.resolve('GET', '/files/a/b.txt')[1])
+
+    def test_register_converter(self):
+        register_converter('hex', '[0-9a-f]+', lambda s: int(s, 16))
+        try:
+            router = Router()
+            router.add(ep('hex', '/colors/{rgb:hex}'))
+            self.assertEqual({'rgb': 255},
+                router.resolve('GET', '/colors/ff')[1])
+        finally:
+            del nudge.router._converters['hex']
+
+
+class RouterTest(unittest.TestCase):
+
+    def test_first_match_wins(self):
+        eps = [
+            ep('a', '/users/me$'),
+            ep('b', '/users/(?P<id>[^/]+)$'),
+            ep('c', '/users/(?P<id>.*)'),
+        ]
+        router = Router()
+        for e in eps:
+            router.add(e)
+        endpoint, match = router.match('GET', '/users/me')
+        self.assertEqual('a', endpoint.name)
+        endpoint, match = router.match('GET', '/users/12')
+        self.assertEqual('b', endpoint.name)
+        self.assertEqual({'id': '12'}, match.groupdict())
+        endpoint, match = router.match('GET', '/users/12/friends')
+        self.assertEqual('c', endpoint.name)
+        self.assertEqual({'id': '12/friends'}, match.groupdict())
+        self.assertEqual((None, None), router.match('POST', '/users/me'))
+
+    def test_multiple_uris(self):
+        router = Router()
+        router.add(Endpoint(name='a', method='GET', function=handler,
+            uris=['/(?P<user>.*)/profile', '/profiles/(?P<user>.*)']))
+        endpoint, match = router.match('GET', '/profiles/bob')
+        self.assertEqual({'user': 'bob'}, match.groupdict())
+
+    def test_matches_linear_scan(self):
+        eps = [ep(str(i), '/r%d/(?P<id>[^/]+)$' % i) for i in range(250)]
+        # unmergeable patterns keep their place in the order
+        eps.insert(120, ep('backref', '/r130/(\w)\\1$'))
+        eps.insert(3, ep('flags', '(?i)/R200/'))
+        router = Router()
+        for e in eps:
+            router.add(e)
+        for path in ['/r0/x', '/r130/aa', '/r130/ab',
+                     '/r200/x', '/r249/y', '/r250/y', '/']:
+            expected = linear_match(eps, 'GET', path)
+            endpoint, match = router.match('GET', path)
+            self.assertTrue(endpoint is expected[0], path)
+            if match:
+                self.assertEqual(expected[1].groupdict(), match.groupdict())
+
+    def test_shared_prefixes(self):
+        eps = [
+            ep('users', '/api/v2/users/(?P<id>[^/]+)$'),
+            ep('user_posts', '/api/v2/users/(?P<id>[^/]+)/posts$'),
+            ep('usage', '/api/v2/usage$'),
+            ep('catchall', '/api/(?P<rest>.*)'),
+            ep('post_users', '/api/v2/users/(?P<id>[^/]+)$', method='POST'),
+            ep('branch', '/x|/api/v2/usage'),
+        ]
+        router = Router()
+        for e in eps:
+            router.add(e)
+        for method, path in [
+                ('GET', '/api/v2/users/1'), ('GET', '/api/v2/users/1/posts'),
+                ('GET', '/api/v2/usage'), ('GET', '/api/v2/use'),
+                ('GET', '/api/v1'), ('POST', '/api/v2/users/1'),
+                ('POST', '/api/v2/usage'), ('GET', '/x'), ('GET', '/ap'),
+                ('DELETE', '/api/v2/users/1')]:
+            self.assertTrue(
+                router.match(method, path)[0] is
+                    linear_match(eps, method, path)[0],
+                method + path)
+
+    def test_methods_are_separate(self):
+        router = Router()
+        router.add(ep('get', '/things/(?P<id>[^/]+)$'))
+        router.add(ep('put', '/things/(?P<id>[^/]+)$', method='PUT'))
+        router.add(ep('post', '/things$', method='POST'))
+        self.assertEqual('put', router.match('PUT', '/things/1')[0].name)
+        self.assertEqual((None, None), router.match('POST', '/things/1'))
+        self.assertEqual(['GET', 'PUT'], router.allowed_methods('/things/1'))
+        self.assertEqual(['POST'], router.allowed_methods('/things'))
+        self.assertEqual([], router.allowed_methods('/nothing'))
+
+    def test_add_after_match(self):
+        router = Router()
+        router.add(ep('a', '/a$'))
+        self.assertEqual((None, None), router.match('GET', '/b'))
+        router.add(ep('b', '/b$'))
+        self.assertEqual('b', router.match('GET', '/b')[0].name)
+
+
+class RouteCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = RouteCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(3, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_resolve_caches_static_routes(self):
+        router = Router(cache_size=10)
+        router.add(ep('static', '/status$'))
+        router.add(ep('user', '/users/(?P<id>[^/]+)$'))
+        for i in range(3):
+            endpoint, path_args = router.resolve('GET', '/status')
+            self.assertEqual('static', endpoint.name)
+            self.assertEqual({}, path_args)
+        self.assertEqual(1, router.cache.misses)
+        self.assertEqual(2, router.cache.hits)
+
+        endpoint, path_args = router.resolve('GET', '/users/1')
+        self.assertEqual({'id': '1'}, path_args)
+        self.assertEqual((None, None), router.resolve('GET', '/nothing'))
+        self.assertEqual(1, len(router.cache))
+
+    def test_add_invalidates(self):
+        router = Router(cache_size=10)
+        router.add(ep('first', '/status'))
+        router.resolve('GET', '/status')
+        self.assertEqual(1, len(router.cache))
+        router.add(ep('static', '/status$'))
+        self.assertEqual(0, len(router.cache))
+        self.assertEqual('first', router.resolve('GET', '/status')[0].name)
+
+    def test_wildcard_routes_not_cached(self):
+        router = Router(cache_size=2)
+        router.add(ep('static', '/status$'))
+        router.add(ep('files', '/files/.*'))
+        router.add(ep('num', '/num/(\\d+)$'))
+        router.add(ep('prefix', '/prefix'))
+        router.resolve('GET', '/status')
+        for i in range(20):
+            self.assertEqual('files',
+                router.resolve('GET', '/files/%d' % i)[0].name)
+            self.assertEqual('num', router.resolve('GET', '/num/%d' % i)[0].name)
+            self.assertEqual('prefix',
+                router.resolve('GET', '/prefix%d' % i)[0].name)
+            self.assertEqual('static', router.resolve('GET', '/status')[0].name)
+        self.assertEqual(1, len(router.cache))
+        self.assertEqual(20, router.cache.hits)
+
+    def test_literal(self):
+        self.assertEqual('/status', _literal('/status$'))
+        self.assertEqual('/status', _literal('/status'))
+        self.assertEqual('/a.b', _literal('/a\\.b$'))
+        for pattern in ['/files/.*', '/num/(\\d+)$', '/a|/b', '/ab?',
+                        '/a\\d', '(?i)/a']:
+            self.assertEqual(None, _literal(pattern), pattern)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,42 @@
+import time
 import unittest
 
 import StringIO
 
-from nudge.publisher import WSGIRequest
+from nose.tools import raises
+
+from nudge.error import HTTPException
+from nudge.headers import WSGIHeaders
+from nudge.utils import is_computed
+from nudge.publisher import WSGIRequest, Environ, parse_query_string
+
+def body_req(body, content_length=True, **limits):
+    environ = {
+        'REQUEST_METHOD':'POST',
+        'REMOTE_ADDR':'127.0.0.1',
+        'wsgi.input': StringIO.StringIO(body),
+    }
+    if content_length:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    req = WSGIRequest(environ)
+    for k, v in limits.items():
+        setattr(req, k, v)
+    return req
+
+class TrickleInput(object):
+    def __init__(self, data, size=3):
+        self.data = data
+        self.size = size
+        self.reads = 0
+    def read(self, size=-1):
+        self.reads += 1
+        chunk, self.data = self.data[:self.size], self.data[self.size:]
+        return chunk
+
+class SlowInput(object):
+    def read(self, size=-1):
+        time.sleep(0.02)
+        return 'x'
 
 class WSGIRequestTest(unittest.TestCase):
 
@@ -31,3 +65,278 @@ class WSGIRequestTest(unittest.TestCase):
         assert req.headers['X-Forwarded-For'] == '10.0.10.123'
         assert req.headers.get('X-Forwarded-For') == '10.0.10.123', req.headers.get('X-Forwarded-For')
 
+    def test_lazy_slots(self):
+        req = body_req('{"a": 1}')
+        assert not hasattr(req, '__dict__')
+        assert not is_computed(req, 'headers')
+        headers = req.headers
+        assert is_computed(req, 'headers')
+        assert req.headers is headers
+        assert not is_computed(req, 'body_stream')
+        self.assertRaises(AttributeError, getattr, req, 'nothing')
+
+    def test_lazy_slots_errors(self):
+        from nudge.utils import LazySlots, lazyprop
+        class Broken(LazySlots):
+            __slots__ = ()
+            @lazyprop
+            def value(self):
+                return self.missing
+        self.assertRaises(RuntimeError, getattr, Broken(), 'value')
+        self.assertFalse(is_computed(Broken(), 'value'))
+
+    def test_environ_not_copied(self):
+        environ = {
+            'REQUEST_METHOD':'GET',
+            'REMOTE_ADDR':'127.0.0.1',
+            'wsgi.input': StringIO.StringIO(),
+            'nested': {'a': 1},
+        }
+        req = WSGIRequest(environ)
+        assert isinstance(req.req, Environ)
+        environ['PATH_INFO'] = '/late'
+        assert req.req['PATH_INFO'] == '/late'
+        assert req.req.REQUEST_METHOD == 'GET'
+        assert req.req.nested.a == 1
+        assert req.req.MISSING is None
+        assert 'REMOTE_ADDR' in req.req
+        def assign():
+            req.req['PATH_INFO'] = '/'
+        self.assertRaises(TypeError, assign)
+
+    def test_body_stream(self):
+        req = body_req('{"a": 1}trailing', content_length=False)
+        req.req._environ['CONTENT_LENGTH'] = '8'
+        assert req.body_stream.read() == '{"a": 1}'
+        # body is the whole spool, wherever the stream has got to
+        assert req.body == '{"a": 1}'
+        assert req.body_stream.read() == ''
+
+    def test_gzip_body(self):
+        import gzip
+        out = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj=out, mode='wb')
+        f.write('{"a": 1}')
+        f.close()
+        req = body_req(out.getvalue())
+        req.req._environ['HTTP_CONTENT_ENCODING'] = 'gzip'
+        req.req._environ['CONTENT_TYPE'] = 'application/json'
+        assert req.json_arguments == {"a": 1}
+
+    def test_iter_ndjson(self):
+        body = '{"a": 1}\n\n[2, 3]\n  \n"four"\n{"five": 5}'
+        req = body_req(body)
+        source = TrickleInput(body)
+        req.req._environ['wsgi.input'] = source
+        records = req.iter_ndjson()
+        self.assertEqual({"a": 1}, records.next())
+        # only what the first record needed has been read
+        assert source.reads < 5
+        self.assertEqual([[2, 3], "four", {"five": 5}], list(records))
+        self.assertRaises(RuntimeError, lambda: req.body)
+
+    def test_body_not_read_to_find_args(self):
+        body = '{"a": 1}\n{"a": 2}\n'
+        req = body_req(body, content_length=False)
+        req.req._environ['CONTENT_TYPE'] = 'application/x-ndjson'
+        source = TrickleInput(body)
+        req.req._environ['wsgi.input'] = source
+        self.assertEqual({}, req.json_arguments)
+        self.assertEqual({}, req.form_arguments)
+        self.assertEqual(0, source.reads)
+
+    def test_empty_multipart_without_content_length(self):
+        req = body_req('', content_length=False)
+        req.req._environ['CONTENT_TYPE'] = 'multipart/form-data; boundary=xyz'
+        self.assertEqual({}, req.form_arguments)
+        self.assertEqual({}, req.files)
+
+    def test_iter_ndjson_bad_line(self):
+        req = body_req('{"a": 1}\n{oops}\n')
+        records = req.iter_ndjson()
+        records.next()
+        try:
+            records.next()
+            self.fail()
+        except HTTPException, e:
+            self.assertEqual(400, e.status_code)
+            self.assertEqual("line 2 of the body is not JSON", e.message)
+
+    def test_iter_json(self):
+        body = '{"total": 3, "items": [{"a": 1}, {"a": 2}, {"a": 3}]}'
+        req = body_req(body)
+        source = TrickleInput(body)
+        req.req._environ['wsgi.input'] = source
+        values = req.iter_json('items.*')
+        self.assertEqual({"a": 1}, values.next())
+        assert source.reads < len(body) / 2
+        self.assertEqual([{"a": 2}, {"a": 3}], list(values))
+
+    def test_iter_json_not_json(self):
+        req = body_req('{"items": [1, 2')
+        try:
+            list(req.iter_json('items.*'))
+            self.fail()
+        except HTTPException, e:
+            self.assertEqual(400, e.status_code)
+            self.assertEqual("body is not JSON", e.message)
+
+    def test_body_spools_to_disk(self):
+        req = body_req('x' * 100, body_spool_size=10)
+        assert req.body_stream._rolled
+        assert req.body == 'x' * 100
+        req = body_req('x' * 100)
+        assert not req.body_stream._rolled
+
+    @raises(HTTPException)
+    def test_content_length_over_limit(self):
+        req = body_req('x' * 100, max_body_size=99)
+        req.req._environ['wsgi.input'] = None
+        req.check_content_length()
+
+    def test_body_over_limit_without_content_length(self):
+        req = body_req('x' * 100, content_length=False, max_body_size=99)
+        try:
+            req.body
+            self.fail()
+        except HTTPException, e:
+            self.assertEqual(413, e.status_code)
+        req = body_req('x' * 100, content_length=False, max_body_size=100)
+        # nothing declared, so only the read itself is checked
+        req.check_content_length()
+        assert req.body == 'x' * 100
+
+    def test_form_body_in_chunks(self):
+        import nudge.publisher
+        body = 'a=1&b=two&a=3&blank=&c=%26'
+        req = body_req(body)
+        req.req._environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        size = nudge.publisher.BODY_CHUNK_SIZE
+        nudge.publisher.BODY_CHUNK_SIZE = 4
+        try:
+            self.assertEqual({'a': ['1', '3'], 'b': ['two'], 'c': ['&']},
+                req.form_arguments)
+        finally:
+            nudge.publisher.BODY_CHUNK_SIZE = size
+        assert req.body == body
+
+    def test_multipart_read_error_closes_files(self):
+        import tempfile
+        import nudge.multipart
+        body = '\r\n'.join(['--xyz',
+            'Content-Disposition: form-data; name="f"; filename="a.txt"',
+            '', 'x' * 200, '--xyz--', ''])
+        class Dropped(TrickleInput):
+            def read(self, size=-1):
+                if self.reads == 3:
+                    raise IOError("connection reset")
+                return TrickleInput.read(self, size)
+        req = body_req(body)
+        req.req._environ['CONTENT_TYPE'] = 'multipart/form-data; boundary=xyz'
+        req.req._environ['wsgi.input'] = Dropped(body, size=50)
+        opened = []
+        spooled = tempfile.SpooledTemporaryFile
+        class Recording(spooled):
+            def __init__(self, *args, **kwargs):
+                spooled.__init__(self, *args, **kwargs)
+                opened.append(self)
+        nudge.multipart.tempfile.SpooledTemporaryFile = Recording
+        try:
+            self.assertRaises(IOError, getattr, req, 'files')
+        finally:
+            nudge.multipart.tempfile.SpooledTemporaryFile = spooled
+        self.assertEqual(1, len(opened))
+        self.assertTrue(opened[0].closed)
+
+    def test_body_timeout(self):
+        req = body_req('', content_length=False, body_timeout=0.01)
+        req.req._environ['CONTENT_LENGTH'] = '5'
+        req.req._environ['wsgi.input'] = SlowInput()
+        try:
+            req.body
+            self.fail()
+        except HTTPException, e:
+            self.assertEqual(408, e.status_code)
+
+    @raises(HTTPException)
+    def test_invalid_content_length(self):
+        req = body_req('x')
+        req.req._environ['CONTENT_LENGTH'] = 'lots'
+        req.body
+
+
+class QueryStringTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual({
+            u'a': [u'1', u'2'],
+            u'empty': [u''],
+            u'sp ace': [u'x y'],
+            u'amp': [u'a&b=c'],
+            u'uni': [u'\xe9'],
+        }, parse_query_string(
+            'a=1&empty=&sp+ace=x%20y&novalue&amp=a%26b%3Dc&a=2&uni=%C3%A9&'))
+        self.assertEqual({}, parse_query_string(''))
+        self.assertEqual({u'a': [u'b=c']}, parse_query_string('a=b=c'))
+
+    def test_limits(self):
+        self.assertEqual(3, len(parse_query_string('a=1&b=2&c=3', 3)))
+        self.assertRaises(
+            HTTPException, parse_query_string, 'a=1&b=2&c=3&d=4', 3)
+        self.assertEqual(
+            {u'abc': [u'1']}, parse_query_string('abc=1', None, 3))
+        self.assertRaises(
+            HTTPException, parse_query_string, 'abcd=1', None, 3)
+
+    @raises(HTTPException)
+    def test_request_limits(self):
+        req = body_req('')
+        req.req._environ['QUERY_STRING'] = '&'.join(
+            'k%d=v' % i for i in range(req.max_query_params + 1))
+        req.query_arguments
+
+
+class HeadersTest(unittest.TestCase):
+
+    def test_lazy_lookup(self):
+        environ = {
+            'HTTP_X_FORWARDED_FOR': '10.0.10.123',
+            'HTTP_ACCEPT': 'text/html',
+            'CONTENT_TYPE': 'application/json',
+            'PATH_INFO': '/',
+        }
+        headers = WSGIHeaders.from_environ(environ)
+        self.assertEqual('10.0.10.123', headers.lookup('x_forwarded_for'))
+        self.assertEqual('application/json', headers['Content-Type'])
+        # only what was asked for has been copied in
+        self.assertEqual(2, dict.__len__(headers))
+        self.assertEqual(None, headers.get('X-Missing'))
+        self.assertFalse('path_info' in headers)
+        headers['Accept'] = 'application/json'
+        self.assertEqual({
+            'x_forwarded_for': '10.0.10.123',
+            'accept': 'application/json',
+            'content_type': 'application/json',
+        }, dict(headers.items()))
+
+    def test_misses_do_not_scan(self):
+        class Unscannable(dict):
+            def iteritems(self):
+                raise AssertionError("environ was scanned")
+        headers = WSGIHeaders.from_environ(Unscannable(HTTP_ACCEPT='*/*'))
+        for i in range(3):
+            self.assertEqual(None, headers.lookup('x_http_method_override'))
+            self.assertEqual(None, headers.get('X-Forwarded-For'))
+        self.assertEqual('*/*', headers['Accept'])
+
+    def test_hyphenated_environ_keys(self):
+        headers = WSGIHeaders.from_environ({'HTTP_X-Custom-Thing': 'yes'})
+        # only found by the name as sent
+        self.assertEqual(None, headers.lookup('x_custom_thing'))
+        self.assertEqual('yes', headers['X-Custom-Thing'])
+        self.assertEqual('yes', headers.lookup('x_custom_thing'))
+
+    def test_plain(self):
+        headers = WSGIHeaders({'X-Custom': 'a'})
+        self.assertEqual('a', headers['x_custom'])
+        self.assertRaises(KeyError, headers.__getitem__, 'Other')